@@ -1,8 +1,7 @@
-import yaml
+import sys
 import logging
 import builtins
 import pprint
-from tqdm import tqdm
 from io import StringIO
 
 logging.basicConfig()
@@ -15,6 +14,25 @@ name = "iboxstacksops"
 __version__ = "1.1.7"
 
 
+# tqdm is imported only when needed (progress bars),
+# till then there are no bars to take care of when printing
+def __getattr__(name):
+    if name == "tqdm":
+        from tqdm import tqdm
+
+        return tqdm
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _tqdm_write(s, end="\n"):
+    tqdm_module = sys.modules.get("tqdm")
+    if tqdm_module:
+        tqdm_module.tqdm.write(s, end=end)
+    else:
+        _original_print(s, end=end)
+
+
 class TqdmLoggingHandler(logging.Handler):
     def __init__(self, level=logging.NOTSET):
         super().__init__(level)
@@ -22,7 +40,7 @@ class TqdmLoggingHandler(logging.Handler):
     def emit(self, record):
         try:
             msg = self.format(record)
-            tqdm.write(msg)
+            _tqdm_write(msg)
             self.flush()
         except Exception:
             self.handleError(record)
@@ -38,28 +56,16 @@ class IboxErrorECSService(Exception):
 
 def tqdm_print(*args, sep="", end="\n", flush=False, **kwargs):
     s = sep.join(str(a) for a in args)
-    tqdm.write(s, end=end)
-    if flush:
-        tqdm._instances.clear()  # optional: force flush if needed
+    _tqdm_write(s, end=end)
+    if flush and "tqdm" in sys.modules:
+        sys.modules["tqdm"].tqdm._instances.clear()  # optional: force flush if needed
 
 
 def tqdm_pprint(*args, **kwargs):
     buf = StringIO()
     _original_pprint(*args, stream=buf, **kwargs)
-    tqdm.write(buf.getvalue().rstrip())
-
-
-def yaml_exclamation_mark(dumper, data):
-    if data.startswith(("!Ref", "!GetAtt", "!GetAZs")):
-        tag = data.split(" ")[0]
-        value = dumper.represent_scalar(tag, data.replace(f"{tag} ", ""))
-    else:
-        value = dumper.represent_scalar("tag:yaml.org,2002:str", data)
-
-    return value
-
+    _tqdm_write(buf.getvalue().rstrip())
 
-yaml.add_representer(str, yaml_exclamation_mark)
 
 # Remove other handlers and add our tqdm handler
 logger.handlers = []
@@ -69,6 +75,7 @@ tqdm_handler.setFormatter(formatter)
 logger.addHandler(tqdm_handler)
 
 # patch print
+_original_print = builtins.print
 builtins.print = tqdm_print
 
 # patch pprint
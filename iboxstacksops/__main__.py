@@ -3,20 +3,37 @@ import sys
 
 from iboxstacksops import IboxError, logger, cfg
 from iboxstacksops.parser import set_cfg
-from iboxstacksops.msg import msg
 
 
 def main():
     set_cfg(sys.argv[1:])
 
+    # imported after parsing args, --help and version do not need them
+    from iboxstacksops import exports, ratelimit, apistats, cassette, trace
+
+    if cfg.replay:
+        cassette.load()
+    from iboxstacksops.msg import msg
+
     # Pre-Init msg client
     cfg.MSG = msg()
 
     try:
-        cfg.func()
+        with trace.span(f"command.{cfg.func.__name__}"):
+            cfg.func()
     except IboxError as e:
         logger.error(f"{e.args[0]}\n")
         return 1
+    finally:
+        exports.log_stats()
+        ratelimit.log_stats()
+        apistats.log_stats()
+        cassette.save()
+        if cfg.simulate:
+            from iboxstacksops import simulator
+
+            simulator.log_stats()
+        trace.save()
 
     return 0
 
@@ -1,6 +1,5 @@
 import json
 import botocore
-import time
 from datetime import timedelta
 
 from . import (
@@ -11,11 +10,14 @@ from . import (
     outputs,
     dashboard,
     table,
+    trace,
+    poller,
+    ecs_monitor,
     IboxErrorECSService,
     IboxError,
 )
 from .tags import get_action_tags
-from .tools import show_confirm
+from .tools import show_confirm, sleep, poll_policy, async_sleep, run_sync
 
 
 # build all args for action
@@ -58,67 +60,167 @@ def _get_action_args(istack):
     return us_args
 
 
+def _get_waiter_tailer(istack, timestamp):
+    if timestamp:
+        return events.event_tailer(istack, timestamp)
+
+    return istack.events_tailer
+
+
+# stack status is refreshed by the shared poller
+def _subscribe(istack):
+    stacks_poller = poller.get(istack)
+
+    return stacks_poller, stacks_poller.subscribe(istack.name, istack.stack.stack_id)
+
+
+# update waiter step, take the stack from the poller watch (or reload it
+# if stale) and show new events, return (update ended, stack changed)
+def _update_waiter_poll(istack, tailer, stacks_poller, watch, stack):
+    changed = stack is not None
+    if stack:
+        istack.stack.meta.data = stack
+        if istack.stack.stack_status in istack.cfg.STACK_COMPLETE_STATUS:
+            try:
+                events.show(istack, tailer)
+            except IboxErrorECSService as e:
+                # update already ended, nothing to cancel
+                logger.warning(e.args[0])
+            return True, changed
+    elif watch.is_stale():
+        try:
+            istack.stack.reload()
+            watch.update(istack.stack.meta.data)
+        except botocore.exceptions.ClientError as e:
+            print(e)
+
+    if events.show(istack, tailer):
+        changed = True
+        stacks_poller.wake()
+
+    return False, changed
+
+
 # wait update until complete showing events status
 def _update_waiter(istack, timestamp=None):
-    last_timestamp = timestamp if timestamp else istack.last_event_timestamp
+    tailer = _get_waiter_tailer(istack, timestamp)
 
     # return without waiting
     if istack.cfg.nowait:
         istack.stack.reload()
         return
 
-    while True:
-        try:
-            istack.stack.reload()
-        except botocore.exceptions.ClientError as e:
-            print(e)
+    stacks_poller, watch = _subscribe(istack)
+    policy = poll_policy(istack.cfg.ACTION_WAITER_SLEEP_TIME)
+    changed = True
+    try:
+        while True:
+            stack = watch.wait(policy.next(changed))
+            try:
+                done, changed = _update_waiter_poll(
+                    istack, tailer, stacks_poller, watch, stack
+                )
+            except IboxErrorECSService as e:
+                # ECS Service did not stabilize, cancel update [ROLLBACK]
+                logger.warning(e.args[0])
+                cancel_update(istack)
+                done, changed = False, True
+            if done:
+                break
+    finally:
+        stacks_poller.unsubscribe(watch)
+        ecs_monitor.remove(istack)
 
-        if istack.stack.stack_status in istack.cfg.STACK_COMPLETE_STATUS:
-            events.show(istack, last_timestamp)
-            break
+    print("\n")
 
-        time.sleep(istack.cfg.ACTION_WAITER_SLEEP_TIME)
 
-        try:
-            last_timestamp = events.show(istack, last_timestamp)
-        except IboxErrorECSService as e:
-            # ECS Service did not stabilize, cancel update [ROLLBACK]
-            logger.warning(e.args[0])
-            cancel_update(istack)
+# as _update_waiter, for the asyncio engine
+async def _update_waiter_async(istack, timestamp=None):
+    tailer = _get_waiter_tailer(istack, timestamp)
+
+    # return without waiting
+    if istack.cfg.nowait:
+        await run_sync(istack.stack.reload)
+        return
+
+    stacks_poller, watch = await run_sync(_subscribe, istack)
+    policy = poll_policy(istack.cfg.ACTION_WAITER_SLEEP_TIME)
+    changed = True
+    try:
+        while True:
+            stack = await watch.wait_async(policy.next(changed))
+            try:
+                done, changed = await run_sync(
+                    _update_waiter_poll, istack, tailer, stacks_poller, watch, stack
+                )
+            except IboxErrorECSService as e:
+                # ECS Service did not stabilize, cancel update [ROLLBACK]
+                logger.warning(e.args[0])
+                await cancel_update_async(istack)
+                done, changed = False, True
+            if done:
+                break
+    finally:
+        stacks_poller.unsubscribe(watch)
+        ecs_monitor.remove(istack)
 
     print("\n")
 
 
+# stackset waiter step, update pending instances (showing them if changed),
+# return (instances, instances changed)
+def _stackset_update_waiter_poll(istack, pending_instances, previous_instances):
+    instances = stackset_instances(istack, False)
+    for n in instances:
+        stack_id = n["StackId"]
+        if any(n["StackInstanceStatus"] == s for s in ["PENDING", "RUNNING"]):
+            pending_instances[stack_id] = n
+        else:
+            try:
+                del pending_instances[stack_id]
+            except Exception:
+                pass
+    changed = previous_instances != instances
+    if pending_instances and changed:
+        print(table.get(list(pending_instances.values()), fields=istack.cfg.fields))
+
+    return instances, changed
+
+
 # wait until all stackset instances finished updating
 def _stackset_update_waiter(istack):
     pending_instances = {}
     previous_instances = {}
-    is_pending = True
-    while is_pending:
-        instances = stackset_instances(istack, False)
-        for n in instances:
-            stack_id = n["StackId"]
-            if any(n["StackInstanceStatus"] == s for s in ["PENDING", "RUNNING"]):
-                pending_instances[stack_id] = n
-            else:
-                try:
-                    del pending_instances[stack_id]
-                except Exception:
-                    pass
-        if pending_instances and previous_instances != instances:
-            print(table.get(list(pending_instances.values())))
-
-        previous_instances = instances
-
-        if pending_instances:
-            time.sleep(5)
-        else:
-            is_pending = False
+    policy = poll_policy(5)
+    while True:
+        previous_instances, changed = _stackset_update_waiter_poll(
+            istack, pending_instances, previous_instances
+        )
+        if not pending_instances:
+            break
+        policy.sleep(changed)
 
     stackset_instances(istack)
 
 
-def create(istack):
+# as _stackset_update_waiter, for the asyncio engine
+async def _stackset_update_waiter_async(istack):
+    pending_instances = {}
+    previous_instances = {}
+    policy = poll_policy(5)
+    while True:
+        previous_instances, changed = await run_sync(
+            _stackset_update_waiter_poll, istack, pending_instances, previous_instances
+        )
+        if not pending_instances:
+            break
+        await policy.async_sleep(changed)
+
+    await run_sync(stackset_instances, istack)
+
+
+# create stack, return False if not confirmed
+def _create_stack(istack):
     stack_tags = [
         {"Key": "Env", "Value": istack.cfg.Env},
         {"Key": "EnvRole", "Value": istack.cfg.EnvRole},
@@ -134,23 +236,49 @@ def create(istack):
     istack.action_tags = get_action_tags(istack, stack_tags)
 
     if not show_confirm():
-        return
+        return False
 
     # get final args for update
     us_args = _get_action_args(istack)
 
-    response = istack.client.create_stack(**us_args)
+    with trace.span("cloudformation.create_stack"):
+        response = istack.client.create_stack(**us_args)
     istack.mylog(f"{json.dumps(response)}\n")
-    time.sleep(1)
 
+    return True
+
+
+def _get_created_stack(istack):
     istack.stack = istack.cloudformation.Stack(istack.name)
-    istack.last_event_timestamp = events.get_last_timestamp(istack)
-    _update_waiter(istack)
+    istack.events_tailer = events.get_tailer(istack)
+
+
+def create(istack):
+    if not _create_stack(istack):
+        return
+    sleep(1)
+
+    _get_created_stack(istack)
+    with trace.span("actions.update_waiter"):
+        _update_waiter(istack)
 
     return True
 
 
-def update(istack):
+# as create, for the asyncio engine
+async def create_async(istack):
+    if not await run_sync(_create_stack, istack):
+        return
+    await async_sleep(1)
+
+    await run_sync(_get_created_stack, istack)
+    await _update_waiter_async(istack)
+
+    return True
+
+
+# return args for update_stack
+def _get_update_args(istack):
     # set tags
     istack.action_tags = get_action_tags(istack, istack.stack.tags)
 
@@ -159,81 +287,155 @@ def update(istack):
 
     outputs.show(istack, "before")
 
-    # -if using changeset ...
-    if not istack.cfg.nochangeset and (
-        len(istack.cfg.stacks) == 1 or istack.cfg.dryrun
-    ):
-        changeset_ok = changeset.process(istack, us_args)
-        if not changeset_ok:
-            return
-        # i have used changeset so no need to do pre-update validation
-        us_args["DisableValidation"] = True
+    return us_args
+
 
+def _use_changeset(istack):
+    return not istack.cfg.nochangeset and (istack.cfg.single_stack or istack.cfg.dryrun)
+
+
+def _update_stack(istack, us_args):
     istack.before["resources"] = resources.get(istack)
-    istack.last_event_timestamp = events.get_last_timestamp(istack)
+    istack.events_tailer = events.get_tailer(istack)
 
     # do stack update
     try:
-        response = istack.client.update_stack(**us_args)
+        with trace.span("cloudformation.update_stack"):
+            response = istack.client.update_stack(**us_args)
     except botocore.exceptions.ClientError as err:
         raise IboxError(err)
     istack.mylog(f"{json.dumps(response)}\n")
-    time.sleep(1)
 
-    # -show update status until complete
-    _update_waiter(istack)
 
+def _show_updated(istack):
     # show changed outputs
     outputs.show_changed(istack)
 
     # update dashboard
-    dashboard.update(istack)
+    with trace.span("dashboard.update"):
+        dashboard.update(istack)
 
-    return True
 
+def update(istack):
+    us_args = _get_update_args(istack)
+
+    # -if using changeset ...
+    if _use_changeset(istack):
+        with trace.span("changeset.process"):
+            changeset_ok = changeset.process(istack, us_args)
+        if not changeset_ok:
+            return
+        # i have used changeset so no need to do pre-update validation
+        us_args["DisableValidation"] = True
+
+    _update_stack(istack, us_args)
+    sleep(1)
 
-def delete(istack):
-    istack.last_event_timestamp = events.get_last_timestamp(istack)
-    response = istack.stack.delete()
-    istack.mylog(f"{json.dumps(response)}\n")
     # -show update status until complete
-    _update_waiter(istack)
+    with trace.span("actions.update_waiter"):
+        _update_waiter(istack)
+
+    _show_updated(istack)
 
     return True
 
 
-def cancel_update(istack):
-    istack.last_event_timestamp = events.get_last_timestamp(istack)
-    response = istack.stack.cancel_update()
-    istack.mylog(f"{json.dumps(response)}\n")
+# as update, for the asyncio engine
+async def update_async(istack):
+    us_args = await run_sync(_get_update_args, istack)
+
+    # -if using changeset ...
+    if _use_changeset(istack):
+        if not await changeset.process_async(istack, us_args):
+            return
+        # i have used changeset so no need to do pre-update validation
+        us_args["DisableValidation"] = True
+
+    await run_sync(_update_stack, istack, us_args)
+    await async_sleep(1)
+
     # -show update status until complete
-    _update_waiter(istack)
+    await _update_waiter_async(istack)
+
+    await run_sync(_show_updated, istack)
 
     return True
 
 
-def continue_update(istack):
-    istack.last_event_timestamp = events.get_last_timestamp(istack)
+def _delete_stack(istack):
+    istack.events_tailer = events.get_tailer(istack)
+    response = istack.stack.delete()
+    istack.mylog(f"{json.dumps(response)}\n")
+
+
+def _cancel_update(istack):
+    istack.events_tailer = events.get_tailer(istack)
+    response = istack.stack.cancel_update()
+    istack.mylog(f"{json.dumps(response)}\n")
+
+
+def _continue_update(istack):
+    istack.events_tailer = events.get_tailer(istack)
     response = istack.client.continue_update_rollback(
         StackName=istack.name, ResourcesToSkip=istack.cfg.resources_to_skip
     )
     istack.mylog(f"{json.dumps(response)}\n")
-    # -show update status until complete
-    _update_waiter(istack)
-
-    return True
 
 
-def rollback(istack):
-    istack.last_event_timestamp = events.get_last_timestamp(istack)
+def _rollback(istack):
+    istack.events_tailer = events.get_tailer(istack)
     response = istack.client.rollback_stack(StackName=istack.name)
     istack.mylog(f"{json.dumps(response)}\n")
-    # -show update status until complete
+
+
+# do action and show update status until complete
+def _action(istack, action):
+    action(istack)
     _update_waiter(istack)
 
     return True
 
 
+# as _action, for the asyncio engine
+async def _action_async(istack, action):
+    await run_sync(action, istack)
+    await _update_waiter_async(istack)
+
+    return True
+
+
+def delete(istack):
+    return _action(istack, _delete_stack)
+
+
+async def delete_async(istack):
+    return await _action_async(istack, _delete_stack)
+
+
+def cancel_update(istack):
+    return _action(istack, _cancel_update)
+
+
+async def cancel_update_async(istack):
+    return await _action_async(istack, _cancel_update)
+
+
+def continue_update(istack):
+    return _action(istack, _continue_update)
+
+
+async def continue_update_async(istack):
+    return await _action_async(istack, _continue_update)
+
+
+def rollback(istack):
+    return _action(istack, _rollback)
+
+
+async def rollback_async(istack):
+    return await _action_async(istack, _rollback)
+
+
 def log(istack):
     last_timestamp = events.get_last_timestamp(istack)
     time_delta = int(istack.cfg.timedelta)
@@ -245,7 +447,7 @@ def log(istack):
         if time_delta < 30:
             time_delta = time_delta * 86400
         time_event = last_timestamp - timedelta(seconds=time_delta)
-        events.show(istack, time_event, time_delta)
+        events.show(istack, events.event_tailer(istack, time_event), time_delta)
 
 
 def show_resources(istack):
@@ -264,7 +466,7 @@ def show_resources(istack):
     istack.mylog(f"STACK RESOURCES:\n{s_table}")
 
 
-def stackset_update(istack):
+def _update_stack_set(istack):
     # set tags
     istack.action_tags = get_action_tags(istack, istack.Tags)
 
@@ -279,13 +481,27 @@ def stackset_update(istack):
     # exit(0)
     response = istack.client.update_stack_set(**us_args)
     istack.mylog(f"{json.dumps(response)}\n")
-    time.sleep(2)
+
+
+def stackset_update(istack):
+    _update_stack_set(istack)
+    sleep(2)
 
     _stackset_update_waiter(istack)
 
     return True
 
 
+# as stackset_update, for the asyncio engine
+async def stackset_update_async(istack):
+    await run_sync(_update_stack_set, istack)
+    await async_sleep(2)
+
+    await _stackset_update_waiter_async(istack)
+
+    return True
+
+
 def stackset_instances(istack, show=True):
     response = istack.client.list_stack_instances(StackSetName=istack.name)
 
@@ -298,7 +514,7 @@ def stackset_instances(istack, show=True):
         ]["DetailedStatus"]
 
     if show:
-        s_table = table.get(response["Summaries"])
+        s_table = table.get(response["Summaries"], fields=istack.cfg.fields)
         print(f"\nStackSetId: {istack.StackSetId}")
         print(s_table)
 
@@ -0,0 +1,257 @@
+import json
+import time
+import threading
+from urllib.parse import urlencode
+
+from . import logger, cfg
+from .ratelimit import THROTTLES_CONTEXT_KEY, is_throttle
+from .tools import get_current_job
+
+# {(service, operation): call_stats} and {(stack, service, operation): ...}
+_stats = {}
+_stack_stats = {}
+_lock = threading.Lock()
+_context_key = "ibox_apistats"
+
+
+class call_stats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        # last bucket counts calls slower than API_STATS_LATENCY_BUCKETS
+        self.histogram = [0] * (len(cfg.API_STATS_LATENCY_BUCKETS) + 1)
+
+    def add(self, call):
+        self.calls += 1
+        self.errors += call["error"]
+        self.retries += call["retries"]
+        self.throttles += call["throttles"]
+        self.bytes_sent += call["bytes_sent"]
+        self.bytes_received += call["bytes_received"]
+        self.latency += call["latency"]
+        self.max_latency = max(self.max_latency, call["latency"])
+        n = 0
+        for n, limit in enumerate(cfg.API_STATS_LATENCY_BUCKETS):
+            if call["latency"] * 1000 <= limit:
+                break
+        else:
+            n += 1
+        self.histogram[n] += 1
+
+    # upper bound (ms) of the histogram bucket containing percentile p
+    def percentile(self, p):
+        count = 0
+        for n, v in enumerate(self.histogram):
+            count += v
+            if count >= self.calls * p / 100:
+                break
+
+        max_latency = round(self.max_latency * 1000, 1)
+        if n < len(cfg.API_STATS_LATENCY_BUCKETS):
+            return min(cfg.API_STATS_LATENCY_BUCKETS[n], max_latency)
+
+        return max_latency
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "throttles": self.throttles,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "latency_avg_ms": round(self.latency * 1000 / self.calls, 1),
+            "latency_p50_ms": self.percentile(50),
+            "latency_p95_ms": self.percentile(95),
+            "latency_max_ms": round(self.max_latency * 1000, 1),
+            "histogram": dict(
+                zip(
+                    [f"<={n}ms" for n in cfg.API_STATS_LATENCY_BUCKETS] + ["slower"],
+                    self.histogram,
+                )
+            ),
+        }
+
+
+# request body is still a dict for query protocol services
+def _get_size(value):
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return len(urlencode(value, doseq=True))
+
+    return 0
+
+
+def _add(service, operation, stack, call):
+    with _lock:
+        key = (service, operation)
+        stack_key = (stack if stack else "-", service, operation)
+        if key not in _stats:
+            _stats[key] = call_stats()
+        if stack_key not in _stack_stats:
+            _stack_stats[stack_key] = call_stats()
+        _stats[key].add(call)
+        _stack_stats[stack_key].add(call)
+
+
+# hook accounting into client calls using botocore events
+def register(client):
+    if not (cfg.api_stats or cfg.api_stats_file):
+        return
+
+    service = client.meta.service_model.service_name
+    service_id = client.meta.service_model.service_id.hyphenize()
+    events = client.meta.events
+
+    def before_call(model, params, context, **kwargs):
+        context[_context_key] = {
+            "operation": model.name,
+            "stack": get_current_job(),
+            "start": time.monotonic(),
+            "bytes_sent": _get_size(params.get("body")),
+            "throttles": 0,
+        }
+
+    # called for every attempt, botocore retries included
+    def needs_retry(response, request_dict, **kwargs):
+        call = request_dict.get("context", {}).get(_context_key)
+        if call and response and is_throttle(response[1]):
+            call["throttles"] += 1
+
+    def _done(context, error, retries=0, bytes_received=0):
+        call = context.pop(_context_key, None)
+        if not call:
+            return
+        throttles = call["throttles"] + context.get(THROTTLES_CONTEXT_KEY, 0)
+        call.update(
+            {
+                "latency": time.monotonic() - call["start"],
+                "error": error,
+                "retries": max(retries, throttles),
+                "throttles": throttles,
+                "bytes_received": bytes_received,
+            }
+        )
+        _add(service, call["operation"], call["stack"], call)
+
+    def after_call(http_response, parsed, context, **kwargs):
+        metadata = parsed.get("ResponseMetadata", {}) if parsed else {}
+        _done(
+            context,
+            http_response.status_code >= 300,
+            metadata.get("RetryAttempts", 0),
+            int(http_response.headers.get("content-length", 0)),
+        )
+
+    def after_call_error(context, **kwargs):
+        _done(context, True)
+
+    events.register(f"before-call.{service_id}", before_call)
+    events.register(f"needs-retry.{service_id}", needs_retry)
+    events.register(f"after-call.{service_id}", after_call)
+    events.register(f"after-call-error.{service_id}", after_call_error)
+
+
+def _get_table(stats):
+    from prettytable import PrettyTable
+
+    table = PrettyTable()
+    table.padding_width = 1
+    table.field_names = [
+        "Service",
+        "Operation",
+        "Calls",
+        "Errors",
+        "Retries",
+        "Throttles",
+        "KB Sent",
+        "KB Received",
+        "Avg ms",
+        "p50 ms",
+        "p95 ms",
+        "Max ms",
+    ]
+    for (service, operation), s in stats:
+        d = s.to_dict()
+        table.add_row(
+            [
+                service,
+                operation,
+                d["calls"],
+                d["errors"],
+                d["retries"],
+                d["throttles"],
+                round(d["bytes_sent"] / 1024, 1),
+                round(d["bytes_received"] / 1024, 1),
+                d["latency_avg_ms"],
+                d["latency_p50_ms"],
+                d["latency_p95_ms"],
+                d["latency_max_ms"],
+            ]
+        )
+    table.align["Service"] = "l"
+    table.align["Operation"] = "l"
+
+    return table
+
+
+def _get_stacks_table(top):
+    from prettytable import PrettyTable
+
+    stacks = {}
+    for (stack, service, operation), s in _stack_stats.items():
+        stack_stats = stacks.setdefault(stack, [0, 0, 0, 0.0])
+        stack_stats[0] += s.calls
+        stack_stats[1] += s.retries
+        stack_stats[2] += s.throttles
+        stack_stats[3] += s.latency
+
+    table = PrettyTable()
+    table.padding_width = 1
+    table.field_names = ["Stack", "Calls", "Retries", "Throttles", "API Time s"]
+    for stack, v in sorted(stacks.items(), key=lambda x: -x[1][0])[:top]:
+        table.add_row([stack, v[0], v[1], v[2], round(v[3], 2)])
+    table.align["Stack"] = "l"
+
+    return table
+
+
+def _save(path):
+    data = {
+        "operations": [
+            dict(service=k[0], operation=k[1], **v.to_dict())
+            for k, v in sorted(_stats.items())
+        ],
+        "stacks": [
+            dict(stack=k[0], service=k[1], operation=k[2], **v.to_dict())
+            for k, v in sorted(_stack_stats.items())
+        ],
+    }
+    try:
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+    except Exception as e:
+        logger.warning(f"Unable to write api stats to {path}: {e}")
+
+
+def log_stats():
+    if not (cfg.api_stats or cfg.api_stats_file) or not _stats:
+        return
+
+    with _lock:
+        if cfg.api_stats:
+            stats = sorted(_stats.items(), key=lambda x: -x[1].calls)
+            print("AWS API calls:")
+            print(_get_table(stats))
+        if cfg.api_stats and len({k[0] for k in _stack_stats}) > 1:
+            print(f"AWS API calls for stack [top {cfg.API_STATS_TOP_STACKS}]:")
+            print(_get_stacks_table(cfg.API_STATS_TOP_STACKS))
+        if cfg.api_stats_file:
+            _save(cfg.api_stats_file)
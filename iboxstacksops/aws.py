@@ -1,68 +1,115 @@
+import threading
 import boto3
+import botocore.session
+from botocore.config import Config
+from botocore.credentials import CredentialProvider
 
-from . import cfg
+from . import cfg, ratelimit, apistats, cassette
+
+# process-wide pool, one session for (profile, region) and one client
+# for (profile, region, service), botocore clients are thread-safe.
+# Resources are not, so they are kept per thread.
+# Credentials are resolved once for profile and shared by all sessions.
+_credentials = {}
+_sessions = {}
+_clients = {}
+_local = threading.local()
+_lock = threading.RLock()
+
+
+def _get_max_pool_connections():
+    jobs = cfg.jobs if cfg.jobs else cfg.MAX_STREAM_JOBS
+
+    return max(cfg.BOTO_MAX_POOL_CONNECTIONS, jobs)
+
+
+# hook rate limiter, api stats, cassette and simulator into client calls
+def _register(client):
+    ratelimit.register(client)
+    apistats.register(client)
+    cassette.register(client)
+    # simulator code is loaded only when simulating
+    if cfg.simulate:
+        from . import simulator
+
+        simulator.register(client)
+
+
+# provide the (refreshable) credentials already resolved for the profile
+class shared_credential_provider(CredentialProvider):
+    METHOD = "ibox-shared"
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+
+    def load(self):
+        return self.credentials
+
+
+def _get_session(profile, region):
+    key = (profile, region)
+
+    with _lock:
+        if key not in _sessions:
+            botocore_session = botocore.session.Session(profile=profile)
+            if profile in _credentials:
+                resolver = botocore_session.get_component("credential_provider")
+                resolver.insert_before(
+                    resolver.providers[0].METHOD,
+                    shared_credential_provider(_credentials[profile]),
+                )
+            session = boto3.session.Session(
+                botocore_session=botocore_session, region_name=region
+            )
+            if profile not in _credentials:
+                _credentials[profile] = session.get_credentials()
+            _sessions[key] = session
+
+    return _sessions[key]
 
 
 class myboto3(object):
     def __init__(self, istack=None, region=None):
         self.istack = istack
-
-        try:
-            cfg.parallel
-            self.parallel = cfg.parallel
-        except Exception:
-            self.parallel = None
-
-        kwarg_session = {}
-        region_name = region if region else cfg.region
-        if region_name:
-            kwarg_session["region_name"] = region_name
-
-        if cfg.profile:
-            kwarg_session["profile_name"] = cfg.profile
-
-        if not self.parallel and not region:
-            try:
-                self.boto3 = cfg.boto3
-            except Exception:
-                self.boto3 = boto3.session.Session(**kwarg_session)
-                cfg.boto3 = self.boto3
-        else:
-            self.boto3 = boto3.session.Session(**kwarg_session)
-
+        self.profile = cfg.profile if cfg.profile else None
+        self.boto3 = _get_session(self.profile, region if region else cfg.region)
         self.region_name = self.boto3.region_name
 
     def client(self, name):
-        attr_name = f"cli_{self.region_name}_{name}"
-
-        if self.parallel and self.istack:
-            obj = self.istack
-        else:
-            obj = cfg
+        key = (self.profile, self.region_name, name)
 
         try:
-            client = getattr(obj, attr_name)
-        except Exception:
-            client = self.boto3.client(name)
-            setattr(obj, attr_name, client)
+            return _clients[key]
+        except KeyError:
+            pass
 
-        return client
+        with _lock:
+            if key not in _clients:
+                client = self.boto3.client(
+                    name,
+                    config=Config(max_pool_connections=_get_max_pool_connections()),
+                )
+                _register(client)
+                _clients[key] = client
 
-    def resource(self, name):
-        attr_name = f"res_{self.region_name}_{name}"
+        return _clients[key]
 
-        if self.parallel:
-            obj = self.istack
-        else:
-            obj = cfg
+    def resource(self, name):
+        key = (self.profile, self.region_name, name)
 
         try:
-            resource = getattr(obj, attr_name)
-        except Exception:
-            resource = self.boto3.resource(name)
-            setattr(obj, attr_name, resource)
-
-        return resource
+            resources = _local.resources
+        except AttributeError:
+            resources = _local.resources = {}
+
+        if key not in resources:
+            # session is not thread-safe
+            with _lock:
+                resource = self.boto3.resource(name)
+            _register(resource.meta.client)
+            resources[key] = resource
+
+        return resources[key]
 
     def init_clients(self, names):
         for name in names:
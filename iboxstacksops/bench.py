@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import contextlib
+
+# Scale benchmarks against the simulated account (see simulator.py).
+# Every account size runs in its own process, so peak RSS is per size:
+#   python -m iboxstacksops.bench --stacks 1000 5000 10000
+# Stacks selection micro-benchmark (CPU time for describe_stacks page):
+#   python -m iboxstacksops.bench --selection
+
+REGION = "eu-west-1"
+UPDATE_STACKS = 500
+UPDATE_JOBS = 50
+THREADS_SAMPLE_TIME = 0.05
+
+# selection micro-benchmark page, --role select one stack of it
+SELECTION_PAGE_STACKS = 100
+SELECTION_OUTPUTS = 30
+SELECTION_PARAMETERS = 60
+SELECTION_ITERATIONS = 200
+
+
+# peak number of threads while a step is running
+class threads_sampler(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = threading.active_count()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(THREADS_SAMPLE_TIME):
+            self.peak = max(self.peak, threading.active_count())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+        return self.peak
+
+
+def _get_peak_rss():
+    # kilobytes on linux, bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss = rss // 1024
+
+    return rss // 1024
+
+
+def _get_steps(args):
+    from . import cfg, stacks, exports, table, i_stack, simulator
+    from .parser import set_cfg
+
+    opts = [
+        "--region",
+        REGION,
+        "--simulate",
+        str(args.worker),
+        "--simulate-throttle",
+        str(args.throttle),
+        "--time-scale",
+        str(args.time_scale),
+        "--api-rate",
+        str(args.api_rate),
+    ]
+    n_roles = max(1, args.worker // simulator.STACKS_FOR_ROLE)
+    roles = [f"role-{n}" for n in range(n_roles)]
+    update_roles = roles[: max(1, UPDATE_STACKS // simulator.STACKS_FOR_ROLE)]
+
+    def get_stacks_cold():
+        set_cfg(opts + ["--refresh", "show", "-t", "ALL"])
+        return len(stacks.get())
+
+    def get_stacks_warm():
+        set_cfg(opts + ["show", "-t", "ALL"])
+        return len(stacks.get())
+
+    def get_exports():
+        cfg.exports = exports.get()
+        return len(cfg.exports)
+
+    def get_table():
+        set_cfg(opts + ["show", "-t", "ALL"])
+        data = list(stacks.get().values())
+        table.get(data)
+        return len(data)
+
+    def resolve_process():
+        set_cfg(opts + ["resolve", "-r", roles[0]])
+        w_stacks = stacks.get()
+        name = sorted(w_stacks)[0]
+        istack = i_stack.ibox_stack(name, w_stacks[name])
+        istack.resolve()
+        return 1
+
+    def update():
+        set_cfg(opts + ["-j", str(UPDATE_JOBS), "update", "-y", "-r"] + update_roles)
+        return len(cfg.func())
+
+    def ssm_put():
+        set_cfg(opts + ["ssm", "put", "-R", REGION, "-r"] + update_roles)
+        cfg.func()
+        return len(update_roles) * simulator.STACKS_FOR_ROLE
+
+    return [
+        ("stacks.get (cold cache)", get_stacks_cold),
+        ("stacks.get (warm cache)", get_stacks_warm),
+        ("exports.get", get_exports),
+        ("table.get", get_table),
+        ("resolve.process", resolve_process),
+        (f"update -j {UPDATE_JOBS}", update),
+        ("ssm put", ssm_put),
+    ]
+
+
+# run all steps for one account size, in this process
+def worker(args):
+    from . import cfg, simulator
+    from .msg import msg
+
+    results = []
+    steps = _get_steps(args)
+    cfg.MSG = msg()
+
+    for name, func in steps:
+        calls = simulator.stats["calls"]
+        throttles = simulator.stats["throttles"]
+        sampler = threads_sampler()
+        sampler.start()
+        start = time.time()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(
+            devnull
+        ), contextlib.redirect_stderr(devnull):
+            try:
+                count = func()
+                error = None
+            except (Exception, SystemExit) as e:
+                count = 0
+                error = repr(e)
+        results.append(
+            {
+                "step": name,
+                "stacks": count,
+                "time": round(time.time() - start, 3),
+                "calls": simulator.stats["calls"] - calls,
+                "throttles": simulator.stats["throttles"] - throttles,
+                "threads": sampler.stop(),
+                "rss_mb": _get_peak_rss(),
+                "error": error,
+            }
+        )
+
+    print(json.dumps(results))
+
+
+def _get_selection_page():
+    page = []
+    for n in range(SELECTION_PAGE_STACKS):
+        outputs = [
+            {"OutputKey": f"Output{i}", "OutputValue": f"value-{i}"}
+            for i in range(SELECTION_OUTPUTS - 1)
+        ]
+        outputs.append({"OutputKey": "EnvRole", "OutputValue": f"role-{n}"})
+        parameters = [
+            {"ParameterKey": f"Parameter{i}", "ParameterValue": f"value-{i}"}
+            for i in range(SELECTION_PARAMETERS)
+        ]
+        page.append(
+            {
+                "StackName": f"stack-{n}",
+                "StackStatus": "UPDATE_COMPLETE",
+                "Outputs": outputs,
+                "Parameters": parameters,
+            }
+        )
+
+    return page
+
+
+# CPU time for page (ms), building base data for every stack and then
+# selecting (before) vs selecting on cheap fields and building base data
+# only for the selected ones (after)
+def selection_bench():
+    from . import cfg, stacks
+
+    cfg.role = ["role-0"]
+    page = _get_selection_page()
+
+    def before():
+        for s in page:
+            stack_data = stacks.get_base_data(s)
+            if stack_data.get("EnvRole") in cfg.role:
+                yield s["StackName"], stack_data
+
+    def after():
+        for s in page:
+            if stacks._is_selected(s["StackName"], s):
+                yield s["StackName"], stacks.get_base_data(s)
+
+    print(
+        f"{SELECTION_PAGE_STACKS} stacks page, {SELECTION_OUTPUTS} outputs and "
+        f"{SELECTION_PARAMETERS} parameters each, --role selecting 1 stack"
+    )
+    for name, func in [("before", before), ("after", after)]:
+        start = time.process_time()
+        for _ in range(SELECTION_ITERATIONS):
+            selected = dict(func())
+        elapsed = (time.process_time() - start) / SELECTION_ITERATIONS * 1000
+        print(f"{name:<8}{elapsed:>8.2f} ms CPU for page [{len(selected)} selected]")
+
+
+def _show(n_stacks, results):
+    print(f"\n{n_stacks} stacks")
+    print(
+        f"{'step':<26}{'stacks':>8}{'time(s)':>10}{'calls':>9}"
+        f"{'throttled':>11}{'threads':>9}{'rss(MB)':>9}"
+    )
+    for r in results:
+        print(
+            f"{r['step']:<26}{r['stacks']:>8}{r['time']:>10.2f}{r['calls']:>9}"
+            f"{r['throttles']:>11}{r['threads']:>9}{r['rss_mb']:>9}"
+        )
+        if r["error"]:
+            print(f"  error: {r['error']}")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Scale benchmarks")
+    parser.add_argument(
+        "--stacks",
+        help="Simulated account sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 5000, 10000],
+    )
+    parser.add_argument(
+        "--throttle", help="Throttling probability", type=float, default=0
+    )
+    parser.add_argument(
+        "--time-scale",
+        help="Scale simulated latency and update time",
+        type=float,
+        default=0.01,
+    )
+    parser.add_argument(
+        "--api-rate",
+        help="Max api calls per second - 0 to disable the rate limiter",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--selection",
+        help="Run only the stacks selection micro-benchmark",
+        action="store_true",
+    )
+    parser.add_argument("--output", help="Write results as json to file", type=str)
+    parser.add_argument("--worker", help=argparse.SUPPRESS, type=int)
+
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+
+    if args.worker:
+        worker(args)
+        return 0
+
+    if args.selection:
+        selection_bench()
+        return 0
+
+    all_results = {}
+    for n in args.stacks:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = dict(os.environ, XDG_CACHE_HOME=cache_dir, AWS_DEFAULT_REGION=REGION)
+            env.setdefault("AWS_ACCESS_KEY_ID", "simulated")
+            env.setdefault("AWS_SECRET_ACCESS_KEY", "simulated")
+            process = subprocess.run(
+                [sys.executable, "-m", "iboxstacksops.bench", "--worker", str(n)]
+                + sys.argv[1:],
+                env=env,
+                stdout=subprocess.PIPE,
+                check=True,
+            )
+        all_results[n] = json.loads(process.stdout.decode().strip().splitlines()[-1])
+        _show(n, all_results[n])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(all_results, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
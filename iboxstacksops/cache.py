@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from datetime import datetime
+
+from . import logger, cfg
+
+_account_ids = {}
+_account_ids_lock = threading.Lock()
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def json_object_hook(obj):
+    if len(obj) == 1 and "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+
+    return obj
+
+
+def _get_dir():
+    base_dir = os.environ.get(
+        "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+    )
+
+    return os.path.join(base_dir, cfg.CACHE_DIR)
+
+
+def get_account_id(boto3):
+    profile = cfg.profile if cfg.profile else "default"
+
+    with _account_ids_lock:
+        if profile not in _account_ids:
+            sts = boto3.client("sts")
+            _account_ids[profile] = sts.get_caller_identity()["Account"]
+
+    return _account_ids[profile]
+
+
+# cache file path is keyed by account/region/profile
+def get_path(name, boto3):
+    profile = cfg.profile if cfg.profile else "default"
+    account = get_account_id(boto3)
+
+    return os.path.join(_get_dir(), account, boto3.region_name, profile, f"{name}.json")
+
+
+# recording or replaying a cassette, api calls must not depend on
+# (nor be skipped because of) local caches
+def _is_disabled():
+    return bool(cfg.record or cfg.replay)
+
+
+def load(path):
+    if _is_disabled():
+        return None
+
+    try:
+        with open(path, "r") as f:
+            data = json.load(f, object_hook=json_object_hook)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable cache {path}: {e}")
+        return None
+
+    return data
+
+
+def save(path, data):
+    if _is_disabled():
+        return
+
+    data = dict(data, timestamp=time.time())
+    dirname = os.path.dirname(path)
+
+    try:
+        os.makedirs(dirname, exist_ok=True)
+        # write to a temp file and rename it, so that a concurrent
+        # reader (or a killed process) never see a partial cache
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, default=json_default)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"Unable to write cache {path}: {e}")
+
+
+def is_fresh(data, max_age):
+    return bool(data and max_age and time.time() - data["timestamp"] < max_age)
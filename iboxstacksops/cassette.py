@@ -0,0 +1,123 @@
+import io
+import json
+import gzip
+import base64
+import threading
+from botocore.awsrequest import AWSResponse
+from botocore.response import StreamingBody
+
+from . import logger, cfg, cache, IboxError
+
+# recorded responses {key: [response, ...]} in call order
+_cassette = {}
+_lock = threading.Lock()
+_replay_index = {}
+_context_key = "ibox_cassette_key"
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, f"{mode}t")
+
+    return open(path, mode)
+
+
+def load():
+    try:
+        with _open(cfg.replay, "r") as f:
+            _cassette.update(json.load(f, object_hook=cache.json_object_hook))
+    except Exception as e:
+        raise IboxError(f"Unable to read cassette {cfg.replay}: {e}")
+
+
+def save():
+    if not cfg.record:
+        return
+
+    with _lock:
+        with _open(cfg.record, "w") as f:
+            json.dump(_cassette, f, default=cache.json_default, separators=(",", ":"))
+    logger.info(f"Recorded {sum(map(len, _cassette.values()))} calls to {cfg.record}")
+
+
+# key of a call, params changing at every run are ignored
+def _get_key(region, service, operation, params):
+    ignore = cfg.CASSETTE_IGNORE_PARAMS.get(operation, [])
+    params = {
+        k: v
+        for k, v in params.items()
+        if k not in ignore and k not in cfg.CASSETTE_IGNORE_PARAMS["*"]
+    }
+
+    return json.dumps([region, service, operation, params], sort_keys=True, default=str)
+
+
+# streaming bodies are read and recorded, the caller get a new stream
+def _record_body(parsed):
+    body = parsed.get("Body")
+    if not isinstance(body, StreamingBody):
+        return parsed
+
+    data = body.read()
+    parsed["Body"] = StreamingBody(io.BytesIO(data), len(data))
+
+    return dict(parsed, Body={"__body__": base64.b64encode(data).decode()})
+
+
+def _replay_body(parsed):
+    body = parsed.get("Body")
+    if not (isinstance(body, dict) and "__body__" in body):
+        return parsed
+
+    data = base64.b64decode(body["__body__"])
+
+    return dict(parsed, Body=StreamingBody(io.BytesIO(data), len(data)))
+
+
+# next recorded response for key, the last one is repeated (ex. polling)
+def _get_response(key):
+    with _lock:
+        responses = _cassette.get(key)
+        if not responses:
+            raise IboxError(f"Call not found in cassette: {key}")
+        n = _replay_index.get(key, 0)
+        _replay_index[key] = n + 1
+
+    return responses[min(n, len(responses) - 1)]
+
+
+# hook record/replay into client calls using botocore events
+def register(client):
+    if not (cfg.record or cfg.replay):
+        return
+
+    region = client.meta.region_name
+    service = client.meta.service_model.service_name
+    service_id = client.meta.service_model.service_id.hyphenize()
+    events = client.meta.events
+
+    def before_parameter_build(params, model, context, **kwargs):
+        context[_context_key] = _get_key(region, service, model.name, params)
+
+    def before_call(context, **kwargs):
+        response = _get_response(context[_context_key])
+        http_response = AWSResponse(None, response["status"], {}, None)
+
+        return http_response, _replay_body(response["parsed"])
+
+    def after_call(http_response, parsed, context, **kwargs):
+        key = context.get(_context_key)
+        if not key:
+            return
+        response = {
+            "status": http_response.status_code,
+            "parsed": _record_body(parsed),
+        }
+        with _lock:
+            _cassette.setdefault(key, []).append(response)
+
+    events.register(f"before-parameter-build.{service_id}", before_parameter_build)
+    if cfg.replay:
+        events.register_last(f"before-call.{service_id}", before_call)
+    else:
+        events.register(f"after-call.{service_id}", after_call)
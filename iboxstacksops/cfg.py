@@ -1,10 +1,13 @@
 # parser default cfg
-stack = role = type = topics = stack_args = cmd_args = tags = []
+stack = role = type = tag = env = topics = stack_args = cmd_args = tags = []
 parallel = region = jobs = pause = version = template = None
 nowait = compact = dryrun = answer_yes = no_stacks = all_stacks = None
+refresh = None
+max_age = 0
 debug = False
 max_retry_ecs_service_running_count = 0
 timedelta = 300
+follow = False
 dashboard = "OnChange"
 statistic = "Average"
 statisticresponse = "p95"
@@ -13,18 +16,101 @@ silent_update = False
 vertical = False
 profile = False
 output = "text"
+record = None
+replay = None
+time_scale = 1
+simulate = 0
+simulate_throttle = 0
+dag = False
+single_stack = False
+waves = []
+wave_max_failures = "0"
+region_jobs = None
+engine = "thread"
+api_rate = 0
+api_stats = False
+api_stats_file = None
+trace = None
+trace_format = "chrome"
+poll_policy = "adaptive"
+poll_floor = 2
+poll_ceiling = 30
+poll_jitter = 0.1
 disable_rollback = False
 dash_force = False
 # changeset_original = False
 print_mylog = True
+exports = {}
 #
 
 OUT_WIDTH = 1000000
 
-MAX_SINGLE_STACKS = 5
+# stacks discovery: up to this number of stacks describe them serially,
+# otherwise shard describe_stacks calls over DISCOVERY_JOBS workers
+DISCOVERY_SERIAL_MAX_STACKS = 5
+DISCOVERY_JOBS = 10
+
+# above this number of changed (or named) stacks do a full paginated
+# describe_stacks instead of describing them one by one
+STACKS_CACHE_MAX_CHANGED = 50
+
+# max concurrent jobs, if not specified, when stacks are streamed
+# (their number is not known in advance)
+MAX_STREAM_JOBS = 100
+
+# asyncio engine: max threads running blocking calls (aws api, output)
+# for all the stacks
+ASYNC_ENGINE_MAX_WORKERS = 32
 
 ACTION_WAITER_SLEEP_TIME = 3
 
+# log of many stacks: max stacks whose events are read for poll
+LOG_MAX_TAILS_PER_POLL = 10
+
+# max services for ecs describe_services call (api limit)
+ECS_DESCRIBE_SERVICES_MAX = 10
+
+# max stack events ids remembered by events tailer
+EVENTS_SEEN_MAX = 1000
+
+# adaptive waiters polling, interval growth while nothing changes
+POLL_BACKOFF = 1.5
+
+# stacks poller, describe waited stacks one by one up to this number
+# (or the pages of the last sweep), if a stack is not refreshed for
+# POLLER_STALE_TIME seconds its waiter describe it directly
+POLLER_SINGLE_MAX_STACKS = 5
+POLLER_STALE_TIME = 30
+
+# api params ignored, for operation or all ("*"), when matching calls
+# in a cassette, they change at every run
+CASSETTE_IGNORE_PARAMS = {
+    "*": ["ClientRequestToken"],
+    "CreateChangeSet": ["ChangeSetName"],
+    "GetMetricStatistics": ["StartTime", "EndTime"],
+    "GetMetricData": ["StartTime", "EndTime"],
+}
+
+# simulator, api call latency and stack update time range (seconds),
+# both scaled by time_scale
+SIMULATOR_LATENCY = 0.05
+SIMULATOR_UPDATE_TIME = (30, 120)
+
+# min max_pool_connections for shared aws clients (botocore default)
+BOTO_MAX_POOL_CONNECTIONS = 10
+
+# aws api rate limiter, per region/service/operation family, burst calls
+# and max concurrent calls in flight (if jobs are not specified)
+API_RATE_BURST = 20
+API_MAX_INFLIGHT = 32
+
+# api calls latency histogram buckets (ms) and stacks shown in the
+# report table (all are written to the json file)
+API_STATS_LATENCY_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+API_STATS_TOP_STACKS = 20
+
+CACHE_DIR = "iboxstacksops"
+
 STACK_BASE_DATA = [
     "StackName",
     "Description",
@@ -99,6 +185,37 @@ STACK_COMPLETE_STATUS = [
     "DELETE_FAILED",
 ]
 
+# stacks that ended in these status updated successfully
+STACK_READY_STATUS = [
+    "UPDATE_COMPLETE",
+    "CREATE_COMPLETE",
+]
+
+STACK_LIVE_STATUS = [
+    "CREATE_IN_PROGRESS",
+    "CREATE_FAILED",
+    "CREATE_COMPLETE",
+    "ROLLBACK_IN_PROGRESS",
+    "ROLLBACK_FAILED",
+    "ROLLBACK_COMPLETE",
+    "DELETE_IN_PROGRESS",
+    "DELETE_FAILED",
+    "UPDATE_IN_PROGRESS",
+    "UPDATE_COMPLETE_CLEANUP_IN_PROGRESS",
+    "UPDATE_COMPLETE",
+    "UPDATE_FAILED",
+    "UPDATE_ROLLBACK_IN_PROGRESS",
+    "UPDATE_ROLLBACK_FAILED",
+    "UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS",
+    "UPDATE_ROLLBACK_COMPLETE",
+    "REVIEW_IN_PROGRESS",
+    "IMPORT_IN_PROGRESS",
+    "IMPORT_COMPLETE",
+    "IMPORT_ROLLBACK_IN_PROGRESS",
+    "IMPORT_ROLLBACK_FAILED",
+    "IMPORT_ROLLBACK_COMPLETE",
+]
+
 CHANGESET_COMPLETE_STATUS = [
     "CREATE_COMPLETE",
     "UPDATE_ROLLBACK_FAILED",
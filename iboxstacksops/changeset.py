@@ -1,7 +1,6 @@
 import time
-from prettytable import PrettyTable
 
-from .tools import show_confirm
+from .tools import show_confirm, sleep, poll_policy, async_sleep, run_sync
 
 
 # create changeset
@@ -22,8 +21,11 @@ def _do_changeset(istack, us_args):
 
 # wait until changeset is created
 def _changeset_waiter(istack, changeset_id):
+    policy = poll_policy(3)
+    status = None
+    changed = True
     while True:
-        time.sleep(3)
+        policy.sleep(changed)
         changeset = istack.client.describe_change_set(
             ChangeSetName=changeset_id,
             StackName=istack.name,
@@ -31,6 +33,27 @@ def _changeset_waiter(istack, changeset_id):
         )
         if changeset["Status"] in istack.cfg.CHANGESET_COMPLETE_STATUS:
             return changeset
+        changed = changeset["Status"] != status
+        status = changeset["Status"]
+
+
+# as _changeset_waiter, for the asyncio engine
+async def _changeset_waiter_async(istack, changeset_id):
+    policy = poll_policy(3)
+    status = None
+    changed = True
+    while True:
+        await policy.async_sleep(changed)
+        changeset = await run_sync(
+            istack.client.describe_change_set,
+            ChangeSetName=changeset_id,
+            StackName=istack.name,
+            IncludePropertyValues=True,
+        )
+        if changeset["Status"] in istack.cfg.CHANGESET_COMPLETE_STATUS:
+            return changeset
+        changed = changeset["Status"] != status
+        status = changeset["Status"]
 
 
 # parse changeset changes
@@ -89,6 +112,8 @@ def _simplify_changeset(changes, not_replaced):
 
 
 def _show_changeset_changes(istack, changes):
+    from prettytable import PrettyTable
+
     fields = ["LogicalResourceId", "ResourceType", "Action"]
     fileds_ex = ["Replacement", "Scope", "Target", "CausingEntity"]
     fields.extend(fileds_ex)
@@ -136,19 +161,18 @@ def list_to_string_list(mylist):
     # return mystring
 
 
-def process(istack, us_args):
-    # -create changeset
+# create changeset, return its id
+def _create(istack, us_args):
     changeset_id = _do_changeset(istack, us_args.copy())
     print("\n")
     istack.mylog("ChangeSetId: %s" % changeset_id)
     print("\n")
-    time.sleep(1)
-    istack.mylog("Waiting ChangeSet Creation..")
 
-    # -wait changeset creation and return it
-    changeset = _changeset_waiter(istack, changeset_id)
-    # pprint(changeset)
+    return changeset_id
 
+
+# show changeset changes and delete it, return True if update is confirmed
+def _show(istack, changeset_id, changeset):
     # -parse changeset changes
     changeset_changes, not_replaced = _parse_changeset(changeset)
 
@@ -168,3 +192,27 @@ def process(istack, us_args):
     else:
         return None
         # _delete_changeset(istack, changeset_id)
+
+
+def process(istack, us_args):
+    # -create changeset
+    changeset_id = _create(istack, us_args)
+    sleep(1)
+    istack.mylog("Waiting ChangeSet Creation..")
+
+    # -wait changeset creation and return it
+    changeset = _changeset_waiter(istack, changeset_id)
+    # pprint(changeset)
+
+    return _show(istack, changeset_id, changeset)
+
+
+# as process, for the asyncio engine
+async def process_async(istack, us_args):
+    changeset_id = await run_sync(_create, istack, us_args)
+    await async_sleep(1)
+    await run_sync(istack.mylog, "Waiting ChangeSet Creation..")
+
+    changeset = await _changeset_waiter_async(istack, changeset_id)
+
+    return await run_sync(_show, istack, changeset_id, changeset)
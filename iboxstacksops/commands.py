@@ -1,12 +1,17 @@
 from pprint import pprint
 
-from . import cfg, stacks, i_stack, i_region, table, ssm
-from .tools import concurrent_exec, get_exports, show_confirm
+from . import cfg
+from .tools import concurrent_exec, show_confirm
+
+# modules needed by commands (and aws libs) are imported by each command,
+# so that parsing args and loading commands stay cheap
 
 
 def create():
+    from . import exports, i_stack
+
     name = cfg.stack[0]
-    cfg.exports = get_exports()
+    cfg.exports = exports.get()
     stack = i_stack.ibox_stack(name, {})
     result = stack.create()
     if result:
@@ -15,20 +20,96 @@ def create():
     return result
 
 
+# yield discovered stacks while appending their names to cfg.stacks
+# discovered stacks, a discovery error is printed and stored in errors
+def _stream_stacks(errors):
+    from . import stacks
+
+    cfg.stacks = []
+    try:
+        for name, data in stacks.get_iter():
+            cfg.stacks.append(name)
+            yield name, data
+    except Exception as e:
+        print(e)
+        errors.append(e)
+
+
+# args to update stacks following their export/import dependencies
+def _get_dag_args(w_stacks):
+    from . import dag
+
+    deps = dag.get(w_stacks)
+    print("Update order:")
+    for n, level in enumerate(dag.get_levels(deps)):
+        print(f"{n}: {level}")
+
+    def on_done(name, result, failed):
+        # exports of the stack may have changed
+        cfg.exports.invalidate(name)
+
+        return dag.is_ready(result, failed)
+
+    return {"deps": deps, "on_done": on_done}
+
+
+# args to update stacks in waves, a stack counts as done
+# (letting the next wave start) only if it completed the update
+def _get_waves_args():
+    from . import dag
+
+    return {
+        "waves": cfg.waves,
+        "max_failures": cfg.wave_max_failures,
+        "on_done": dag.is_ready,
+    }
+
+
 def update():
+    from . import stacks, exports, i_stack
+
+    if (
+        stacks.has_selectors()
+        and (cfg.answer_yes or cfg.dryrun)
+        and not cfg.dag
+        and not cfg.waves
+    ):
+        # no bulk confirmation needed, start updating stacks
+        # while discovery is still in progress, their number is not known
+        # so treat them as many stacks
+        cfg.single_stack = False
+        cfg.exports = exports.get()
+        errors = []
+        result = concurrent_exec("update", _stream_stacks(errors), i_stack)
+        # stacks discovered before the error have been updated anyway
+        if errors:
+            return
+        if not cfg.dryrun:
+            pprint(result)
+
+        return result
+
+    # discover-then-confirm
     try:
         w_stacks = stacks.get()
     except Exception as e:
         print(e)
         return
     cfg.stacks = list(w_stacks.keys())
-    cfg.exports = get_exports()
-    if len(w_stacks) > 1 and (cfg.role or cfg.type) and not cfg.dryrun:
+    cfg.single_stack = len(w_stacks) == 1
+    cfg.exports = exports.get()
+    if cfg.dag and len(w_stacks) > 1:
+        order_args = _get_dag_args(w_stacks)
+    elif cfg.waves:
+        order_args = _get_waves_args()
+    else:
+        order_args = {}
+    if len(w_stacks) > 1 and stacks.has_selectors() and not cfg.dryrun:
         print("You are going to UPDATE the following stacks:")
         print(cfg.stacks)
         if not show_confirm():
             return
-    result = concurrent_exec("update", w_stacks, i_stack)
+    result = concurrent_exec("update", w_stacks, i_stack, **order_args)
     if not cfg.dryrun:
         pprint(result)
 
@@ -36,6 +117,8 @@ def update():
 
 
 def delete():
+    from . import stacks, i_stack
+
     try:
         w_stacks = stacks.get()
     except Exception as e:
@@ -53,12 +136,13 @@ def delete():
 
 
 def cancel_update():
+    from . import stacks, i_stack
+
     try:
         w_stacks = stacks.get()
     except Exception as e:
         print(e)
         return
-    cfg.exports = get_exports()
     result = concurrent_exec("cancel_update", w_stacks, i_stack)
     pprint(result)
 
@@ -66,12 +150,13 @@ def cancel_update():
 
 
 def continue_update():
+    from . import stacks, i_stack
+
     try:
         w_stacks = stacks.get()
     except Exception as e:
         print(e)
         return
-    cfg.exports = get_exports()
     result = concurrent_exec("continue_update", w_stacks, i_stack)
     pprint(result)
 
@@ -79,12 +164,13 @@ def continue_update():
 
 
 def rollback():
+    from . import stacks, i_stack
+
     try:
         w_stacks = stacks.get()
     except Exception as e:
         print(e)
         return
-    cfg.exports = get_exports()
     result = concurrent_exec("rollback", w_stacks, i_stack)
     pprint(result)
 
@@ -92,16 +178,20 @@ def rollback():
 
 
 def parameters():
+    from . import stacks, exports, i_stack
+
     try:
         w_stacks = stacks.get()
     except Exception as e:
         print(e)
         return
-    cfg.exports = get_exports()
+    cfg.exports = exports.get()
     concurrent_exec("parameters", w_stacks, i_stack)
 
 
 def info():
+    from . import stacks, i_stack
+
     if not cfg.compact:
         cfg.OUT_WIDTH = 80
     try:
@@ -115,6 +205,8 @@ def info():
 
 
 def show_resources():
+    from . import stacks, i_stack
+
     try:
         w_stacks = stacks.get()
     except Exception as e:
@@ -124,24 +216,51 @@ def show_resources():
 
 
 def log():
-    name = cfg.stack[0]
-    stack = i_stack.ibox_stack(name, {})
-    stack.log()
+    from . import stacks, events, i_stack
+
+    try:
+        w_stacks = stacks.get()
+    except Exception as e:
+        print(e)
+        return
+
+    # single stack, keep waiter (with ECS services deployments)
+    if len(w_stacks) == 1 and not cfg.follow:
+        name, data = next(iter(w_stacks.items()))
+        stack = i_stack.ibox_stack(name, data)
+        stack.log()
+        return
+
+    time_delta = int(cfg.timedelta)
+    if 0 < time_delta < 30:
+        time_delta = time_delta * 86400
+
+    istacks = []
+    for name, data in w_stacks.items():
+        stack = i_stack.ibox_stack(name, data)
+        stack.stack = stack.cloudformation.Stack(name)
+        istacks.append(stack)
+
+    events.follow(istacks, time_delta, cfg.follow)
 
 
 def resolve():
+    from . import stacks, exports, i_stack
+
     try:
         w_stacks = stacks.get()
     except Exception as e:
         print(e)
         return
-    cfg.exports = get_exports()
+    cfg.exports = exports.get()
     result = concurrent_exec("resolve", w_stacks, i_stack)
 
     return result
 
 
 def dash():
+    from . import stacks, i_stack
+
     try:
         w_stacks = stacks.get()
     except Exception as e:
@@ -155,6 +274,8 @@ def dash():
 
 
 def show_table():
+    from . import stacks, table
+
     try:
         w_stacks = stacks.get()
     except Exception as e:
@@ -167,14 +288,18 @@ def show_table():
 
 
 def ssm_setup():
+    from . import stacks, i_region
+
     w_stacks = stacks.get(exit_if_empty=False)
     result = concurrent_exec("ssm_setup", {k: w_stacks for k in cfg.regions}, i_region)
     pprint(result)
 
 
 def ssm_put():
+    from . import stacks, exports, ssm, i_stack, i_region
+
     w_stacks = stacks.get()
-    cfg.exports = get_exports()
+    cfg.exports = exports.get()
     stacks_params = concurrent_exec("parameters", w_stacks, i_stack, **{"check": True})
     regions = ssm.get_setupped_regions()
     w_regions = cfg.regions if cfg.regions else regions
@@ -185,6 +310,8 @@ def ssm_put():
 
 
 def ssm_show():
+    from . import stacks, ssm, i_region
+
     w_stacks = stacks.get()
     regions = ssm.get_setupped_regions()
     result = concurrent_exec("ssm_get", {k: w_stacks for k in regions}, i_region)
@@ -193,23 +320,27 @@ def ssm_show():
 
 
 def r53():
+    from . import stacks, i_stack
+
     try:
         w_stacks = stacks.get()
     except Exception as e:
         print(e)
         return
-    cfg.exports = get_exports()
     result = concurrent_exec("r53", w_stacks, i_stack)
     pprint(result)
 
 
 def replicate():
+    from . import ssm, i_region
+    from .aws import myboto3
+
     regions = ssm.get_setupped_regions() if not cfg.regions else cfg.regions
 
     if cfg.no_replicate_current:
         try:
-            regions.remove(cfg.boto3.region_name)
-        except Exception:
+            regions.remove(myboto3().region_name)
+        except ValueError:
             pass
 
     result = concurrent_exec("replicate", {k: {} for k in regions}, i_region)
@@ -219,9 +350,11 @@ def replicate():
 
 
 def stackset():
+    from . import stacks, exports, i_stack
+
     name = cfg.stack[0]
     stackset = stacks.get(stackset=True)
-    cfg.exports = get_exports()
+    cfg.exports = exports.get()
     stack = i_stack.ibox_stack(name, stackset[name])
     cmd = getattr(stack, f"stackset_{cfg.command_stackset}")
     result = cmd()
@@ -0,0 +1,148 @@
+import concurrent.futures
+
+from . import logger, cfg, IboxError
+
+
+# the template the stack is going to be updated with
+def _get_template(istack):
+    from . import template
+
+    istack.exports = istack.cfg.exports
+    try:
+        return template.get_template(istack)
+    except IboxError as e:
+        logger.warning(f"{istack.name} # {e.args[0]}, no dependencies")
+        return {}
+
+
+# resolve an export name using the stack parameters (pseudo ones included),
+# return None if it depends on values known only at update time
+def _resolve(value, params):
+    if isinstance(value, str):
+        return value
+
+    if not isinstance(value, dict) or len(value) != 1:
+        return
+
+    func, v = next(iter(value.items()))
+    if func == "Ref":
+        return params.get(v)
+    if func == "Fn::Sub":
+        sub_string, sub_data = (v[0], v[1]) if isinstance(v, list) else (v, {})
+        for key, key_value in dict(params, **sub_data).items():
+            key_value = _resolve(key_value, params)
+            if key_value is None:
+                continue
+            sub_string = sub_string.replace("${" + key + "}", key_value)
+        return None if "${" in sub_string else sub_string
+    if func == "Fn::Join":
+        values = [_resolve(n, params) for n in v[1]]
+        return None if None in values else v[0].join(values)
+
+
+def _find_imports(value, imports):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            if k == "Fn::ImportValue":
+                imports.append(v)
+            else:
+                _find_imports(v, imports)
+    elif isinstance(value, list):
+        for v in value:
+            _find_imports(v, imports)
+
+
+# parameters the stack is going to be updated with: cmd args,
+# current values, defaults of the new ones and pseudo parameters
+def _get_params(istack, template):
+    from .resolve import get_pseudo_parameters
+
+    c_parameters = getattr(istack, "c_parameters", {})
+    params = {}
+    for n, v in (template.get("Parameters") or {}).items():
+        cfg_value = getattr(istack.cfg, n, None)
+        if cfg_value is not None:
+            params[n] = cfg_value
+        elif n in c_parameters:
+            params[n] = c_parameters[n]
+        elif "Default" in v:
+            params[n] = v["Default"]
+    params.update(get_pseudo_parameters(istack))
+
+    return params
+
+
+# return (exports, imports) names of a stack
+def _get_stack_links(name, data):
+    from .i_stack import ibox_stack
+
+    istack = ibox_stack(name, data)
+    template = _get_template(istack)
+    params = _get_params(istack, template)
+    exports = []
+    imports = []
+
+    for output in (template.get("Outputs") or {}).values():
+        export = output.get("Export", {}).get("Name")
+        if export is not None:
+            exports.append(_resolve(export, params))
+
+    _find_imports(template.get("Resources"), imports)
+    _find_imports(template.get("Outputs"), imports)
+    imports = [_resolve(n, params) for n in imports]
+
+    return [n for n in exports if n], [n for n in imports if n]
+
+
+# {stack: set(stacks it imports from)}, only for the selected stacks
+def get(w_stacks):
+    producers = {}
+    stack_imports = {}
+
+    logger.info("Getting Stacks Dependencies")
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=cfg.DISCOVERY_JOBS
+    ) as executor:
+        future_to_stack = {
+            executor.submit(_get_stack_links, n, v): n for n, v in w_stacks.items()
+        }
+        for future in concurrent.futures.as_completed(future_to_stack):
+            name = future_to_stack[future]
+            exports, imports = future.result()
+            for n in exports:
+                producers[n] = name
+            stack_imports[name] = imports
+
+    deps = {}
+    for name, imports in stack_imports.items():
+        deps[name] = {
+            producers[n] for n in imports if n in producers and producers[n] != name
+        }
+
+    return deps
+
+
+# topological levels, stacks of a level depend only on previous ones
+def get_levels(deps):
+    levels = []
+    done = set()
+    waiting = dict(deps)
+    while waiting:
+        level = sorted(n for n, v in waiting.items() if v <= done)
+        if not level:
+            raise IboxError(f"Dependency cycle between stacks: {sorted(waiting)}")
+        levels.append(level)
+        done.update(level)
+        for n in level:
+            del waiting[n]
+
+    return levels
+
+
+# dependents can start if the stack completed or had nothing to update,
+# result is None if the update was not executed (dryrun or not confirmed)
+def is_ready(result, failed):
+    if failed:
+        return "No updates are to be performed" in str(result)
+
+    return result is None or result in cfg.STACK_READY_STATUS
@@ -0,0 +1,298 @@
+import threading
+from pprint import pformat
+from copy import deepcopy
+
+from . import logger, cfg, trace
+from .tools import poll_policy
+
+# One background monitor for region follow the deployments of all the ECS
+# services updated by in-flight stacks, grouped by cluster and described
+# up to ECS_DESCRIBE_SERVICES_MAX services for call.
+# Stacks waiters keep tailing events meanwhile and check for services that
+# did not stabilize.
+
+_monitors = {}
+_lock = threading.Lock()
+
+
+# deployments of a service, logged when changed
+class service_watch(object):
+    def __init__(self, istack, cluster, service, stack_tasks_defs):
+        self.istack = istack
+        self.cluster = cluster
+        self.service = service
+        # copy, circuit breaker rollback add the previous TaskDefinition
+        self.stack_tasks_defs = list(stack_tasks_defs)
+        self.pri_task_def = None
+        self.rollout_state = None
+        self.deps_before = {}
+        self.deps_len = 0
+        self.error = None
+        self.missing = False
+
+    def is_done(self):
+        if self.missing:
+            return True
+
+        return not (
+            self.pri_task_def not in self.stack_tasks_defs
+            or self.deps_len > 1
+            or self.rollout_state == "IN_PROGRESS"
+        )
+
+    # process service description, return True if deployments changed
+    def update(self, service):
+        istack = self.istack
+        max_retry = istack.cfg.max_retry_ecs_service_running_count
+        deps = {
+            "PRIMARY": {},
+            "ACTIVE": {},
+            "INACTIVE": {},
+            "DRAINING": {},
+        }
+
+        deployments = service["deployments"]
+        self.deps_len = len(deployments)
+        last_updatedAt = None
+
+        # find out if service have Deployment Circuit Breaker RollBack enabled
+        try:
+            circuit_breaker_rollback = service["deploymentConfiguration"][
+                "deploymentCircuitBreaker"
+            ]["rollback"]
+        except Exception:
+            circuit_breaker_rollback = False
+
+        for dep in deployments:
+            status = dep["status"]
+            dep_updatedAt = dep.get("updatedAt")
+            if dep_updatedAt and (not last_updatedAt or dep_updatedAt > last_updatedAt):
+                last_updatedAt = dep_updatedAt
+            for p in [
+                "taskDefinition",
+                "desiredCount",
+                "runningCount",
+                "pendingCount",
+                "failedTasks",
+                "rolloutState",
+            ]:
+                deps[status][p] = dep.get(p)
+
+        pri_task_def = self.pri_task_def = deps["PRIMARY"]["taskDefinition"]
+        failedTasks = deps["PRIMARY"]["failedTasks"]
+        self.rollout_state = deps["PRIMARY"]["rolloutState"]
+        deps_before = self.deps_before
+
+        if deps == deps_before:
+            return False
+
+        # deployment have changed process it
+
+        # check for Deployment Circuit Breaker
+        if (
+            all("ACTIVE" in dp for dp in [deps, deps_before])
+            and deps["ACTIVE"].get("rolloutState") == "FAILED"
+            and deps_before["ACTIVE"].get("taskDefinition") == pri_task_def
+        ):
+            # PRIMARY taskDefinition have changed means that:ECS Deployment Circuit Breaker was triggered
+            # put PRIAMRY taskDefinition, the previous one, in stack_tasks_defs to avoid loop
+            istack.mylog(
+                "Deployment failed! ECS Deployment Circuit Breaker was triggered\n"
+            )
+            self.stack_tasks_defs.append(pri_task_def)
+
+        if last_updatedAt:
+            istack.mylog(last_updatedAt.strftime("%Y-%m-%d %X"))
+
+        self.deps_before = deepcopy(deps)
+
+        # log short version of taskDefinitions
+        for d in ["PRIMARY", "ACTIVE", "DRAINING"]:
+            if "taskDefinition" in deps[d]:
+                deps[d]["taskDefinition"] = deps[d]["taskDefinition"].split("/")[-1]
+
+        istack.mylog("PRIMARY: %s" % pformat(deps["PRIMARY"], width=1000000))
+        istack.mylog("ACTIVE: %s" % pformat(deps["ACTIVE"], width=1000000))
+        istack.mylog("DRAINING: %s\n" % pformat(deps["DRAINING"], width=1000000))
+
+        # is update stuck ? Do AutoRollback, but skip if ECS Deployment Circuit Breaker is enabled
+        if (
+            not circuit_breaker_rollback
+            and max_retry > 0
+            and pri_task_def in self.stack_tasks_defs
+            and failedTasks >= max_retry
+        ):
+            self.error = (
+                "ECS Service did not stabilize "
+                f"[{failedTasks} >= {max_retry}] - "
+                "cancelling update [ROLLBACK]"
+            )
+
+        return True
+
+
+class ecs_monitor(object):
+    def __init__(self, client):
+        self.client = client
+        # {(stack, cluster, service): service_watch}
+        self.watches = {}
+        # {stack: TaskDefinitions}, listed once for update
+        self.tasks_defs = {}
+        self.cond = threading.Condition()
+        self.thread = None
+        self.added = False
+        self.policy = poll_policy(5)
+
+    def _get_stack_tasks_defs(self, istack):
+        try:
+            return self.tasks_defs[istack.name]
+        except KeyError:
+            pass
+
+        tasks_defs = [
+            res.physical_resource_id
+            for res in istack.stack.resource_summaries.all()
+            if res.resource_type == "AWS::ECS::TaskDefinition"
+        ]
+        with self.cond:
+            self.tasks_defs[istack.name] = tasks_defs
+
+        return tasks_defs
+
+    def add(self, istack, event):
+        # get cluster and service from service arn
+        try:
+            cluster_name = event.physical_resource_id.split("/")[1]
+            service_name = event.physical_resource_id.split("/")[2]
+        except Exception:
+            istack.mylog(
+                f"Unable to retrieve Cluster and Service name from event Physical Resource ID: {event.physical_resource_id}\n"
+                "skipping Service deployment logging."
+            )
+            return
+
+        watch = service_watch(
+            istack,
+            cluster_name,
+            service_name,
+            self._get_stack_tasks_defs(istack),
+        )
+        with self.cond:
+            self.watches[(istack.name, cluster_name, service_name)] = watch
+            self.added = True
+            if not self.thread:
+                self.thread = threading.Thread(
+                    target=self._run, name="ecs-monitor", daemon=True
+                )
+                self.thread.start()
+
+    # return and remove the error of a stack service that did not stabilize
+    def get_error(self, istack):
+        with self.cond:
+            for key, watch in list(self.watches.items()):
+                if watch.istack is istack and watch.error:
+                    del self.watches[key]
+                    return watch.error
+
+    # stop monitoring stack services, update ended
+    def remove(self, istack):
+        with self.cond:
+            for key, watch in list(self.watches.items()):
+                if watch.istack is istack:
+                    del self.watches[key]
+            self.tasks_defs.pop(istack.name, None)
+            self.cond.notify_all()
+
+    def _describe(self, cluster, watches):
+        changed = False
+        max_services = cfg.ECS_DESCRIBE_SERVICES_MAX
+        for n in range(0, len(watches), max_services):
+            batch = {w.service: w for w in watches[n : n + max_services]}
+            response = self.client.describe_services(
+                cluster=cluster, services=list(batch)
+            )
+            for service in response["services"]:
+                watch = batch.get(service["serviceName"])
+                if watch:
+                    changed = watch.update(service) or changed
+            for failure in response.get("failures", []):
+                logger.warning(f"ECS monitor {cluster}: {failure}")
+                # missing service, stop monitoring it
+                watch = batch.get(failure.get("arn", "").split("/")[-1])
+                if watch:
+                    watch.missing = True
+
+        return changed
+
+    # return True if any deployment changed
+    def _poll(self):
+        clusters = {}
+        with self.cond:
+            for watch in self.watches.values():
+                if not watch.error:
+                    clusters.setdefault(watch.cluster, []).append(watch)
+
+        changed = False
+        with trace.span("ecs_monitor.poll", clusters=len(clusters)):
+            for cluster, watches in clusters.items():
+                try:
+                    changed = self._describe(cluster, watches) or changed
+                except Exception as e:
+                    # keep monitoring, a failed poll must not stop the thread
+                    logger.warning(f"ECS monitor {cluster}: {e}")
+
+        # deployment completed
+        with self.cond:
+            for key, watch in list(self.watches.items()):
+                if watch.is_done() and not watch.error:
+                    del self.watches[key]
+
+        return changed
+
+    def _run(self):
+        try:
+            while True:
+                changed = self._poll()
+                with self.cond:
+                    # new services count as changes
+                    changed = changed or self.added
+                    self.added = False
+                    self.cond.wait_for(
+                        lambda: not self.watches,
+                        self.policy.next(changed) * cfg.time_scale,
+                    )
+                    if not self.watches:
+                        self.thread = None
+                        return
+        finally:
+            # on errors too, let next add start a new thread
+            with self.cond:
+                if self.thread is threading.current_thread():
+                    self.thread = None
+
+
+def _get_key(istack):
+    return istack.boto3.profile, istack.boto3.region_name
+
+
+def get(istack):
+    key = _get_key(istack)
+
+    with _lock:
+        if key not in _monitors:
+            _monitors[key] = ecs_monitor(istack.boto3.client("ecs"))
+
+    return _monitors[key]
+
+
+# error of a stack service that did not stabilize, if any
+def get_error(istack):
+    monitor = _monitors.get(_get_key(istack))
+
+    return monitor.get_error(istack) if monitor else None
+
+
+def remove(istack):
+    monitor = _monitors.get(_get_key(istack))
+    if monitor:
+        monitor.remove(istack)
@@ -1,136 +1,67 @@
 import time
-from datetime import datetime
-from pprint import pformat
+import heapq
+from datetime import datetime, timedelta
 from calendar import timegm
-from copy import deepcopy
+from collections import deque
 
-from . import IboxErrorECSService
+from . import cfg, ecs_monitor, poller, IboxErrorECSService
+from .tools import poll_policy
 
 
-# show old and new service tasks during an update
-def _show_service_update(istack, event, timedelta):
-    # avoid showing current service log if is requested a stack past event
-    if timedelta != "0":
-        return
+# Incremental stack events tailer, events (newest first) are read only
+# until a seen one or one older than the last seen timestamp, so only
+# the first page(s) are fetched. Seen EventIds are bounded to
+# EVENTS_SEEN_MAX, events with the same timestamp are told apart by id.
+class event_tailer(object):
+    def __init__(self, istack, timestamp=None):
+        self.istack = istack
+        self.timestamp = timestamp
+        self.seen = deque()
+        self.seen_ids = set()
 
-    pri_task_def = rolloutState = None
-    deps_before = {}
-    deps_len = 0
-    max_retry = istack.cfg.max_retry_ecs_service_running_count
-    client = istack.boto3.client("ecs")
+    def _add_seen(self, event):
+        if len(self.seen) >= cfg.EVENTS_SEEN_MAX:
+            self.seen_ids.discard(self.seen.popleft())
+        self.seen.append(event.id)
+        self.seen_ids.add(event.id)
 
-    # get the current Stack TaskDefinitions to be deployed
-    stack_tasks_defs = [
-        res.physical_resource_id
-        for res in istack.stack.resource_summaries.all()
-        if res.resource_type == "AWS::ECS::TaskDefinition"
-    ]
+    def _is_new(self, event):
+        if event.id in self.seen_ids:
+            return False
 
-    # get cluster and service from service arn
-    try:
-        cluster_name = event.physical_resource_id.split("/")[1]
-        service_name = event.physical_resource_id.split("/")[2]
-    except Exception:
-        istack.mylog(
-            f"Unable to retrieve Cluster and Service name from event Physical Resource ID: {event.physical_resource_id}\n"
-            "skipping Service deployment logging."
-        )
-        return
+        return not self.timestamp or event.timestamp >= self.timestamp
+
+    # mark as seen the last event (and the ones with the same timestamp)
+    def skip(self):
+        for event in self.istack.stack.events.all():
+            if self.timestamp and event.timestamp < self.timestamp:
+                break
+            self.timestamp = event.timestamp
+            self._add_seen(event)
+
+    # return new events, oldest first
+    def get(self):
+        events = []
+        for event in self.istack.stack.events.all():
+            if not self._is_new(event):
+                break
+            events.append(event)
+
+        events.reverse()
+        for event in events:
+            self._add_seen(event)
+        if events:
+            self.timestamp = events[-1].timestamp
 
-    while (
-        pri_task_def not in stack_tasks_defs
-        or deps_len > 1
-        or rolloutState == "IN_PROGRESS"
-    ):
-        deps = {
-            "PRIMARY": {},
-            "ACTIVE": {},
-            "INACTIVE": {},
-            "DRAINING": {},
-        }
-
-        service = client.describe_services(
-            cluster=cluster_name,
-            services=[service_name],
-        )["services"][0]
-
-        # dep_task_def = service["taskDefinition"]
-        deployments = service["deployments"]
-        deps_len = len(deployments)
-        last_updatedAt = None
-
-        # find out if service have Deployment Circuit Breaker RollBack enabled
-        try:
-            circuit_breaker_rollback = service["deploymentConfiguration"][
-                "deploymentCircuitBreaker"
-            ]["rollback"]
-        except Exception:
-            circuit_breaker_rollback = False
-
-        for dep in deployments:
-            status = dep["status"]
-            dep_updatedAt = dep.get("updatedAt")
-            if dep_updatedAt and (not last_updatedAt or dep_updatedAt > last_updatedAt):
-                last_updatedAt = dep_updatedAt
-            for p in [
-                "taskDefinition",
-                "desiredCount",
-                "runningCount",
-                "pendingCount",
-                "failedTasks",
-                "rolloutState",
-            ]:
-                deps[status][p] = dep.get(p)
-
-        pri_task_def = deps["PRIMARY"]["taskDefinition"]
-        failedTasks = deps["PRIMARY"]["failedTasks"]
-        rolloutState = deps["PRIMARY"]["rolloutState"]
-
-        if deps != deps_before:
-            # deployment have changed process it
-
-            # check for Deployment Circuit Breaker
-            if (
-                all("ACTIVE" in dp for dp in [deps, deps_before])
-                and deps["ACTIVE"].get("rolloutState") == "FAILED"
-                and deps_before["ACTIVE"].get("taskDefinition") == pri_task_def
-            ):
-                # PRIMARY taskDefinition have changed means that:ECS Deployment Circuit Breaker was triggered
-                # put PRIAMRY taskDefinition, the previous one, in stack_tasks_defs to avoid loop
-                istack.mylog(
-                    "Deployment failed! ECS Deployment Circuit Breaker was triggered\n"
-                )
-                stack_tasks_defs.append(pri_task_def)
-
-            if last_updatedAt:
-                istack.mylog(last_updatedAt.strftime("%Y-%m-%d %X"))
-
-            deps_before = deepcopy(deps)
-
-            # log short version of taskDefinitions
-            for d in ["PRIMARY", "ACTIVE", "DRAINING"]:
-                if "taskDefinition" in deps[d]:
-                    deps[d]["taskDefinition"] = deps[d]["taskDefinition"].split("/")[-1]
-
-            istack.mylog("PRIMARY: %s" % pformat(deps["PRIMARY"], width=1000000))
-            istack.mylog("ACTIVE: %s" % pformat(deps["ACTIVE"], width=1000000))
-            istack.mylog("DRAINING: %s\n" % pformat(deps["DRAINING"], width=1000000))
-
-            # is update stuck ? Do AutoRollback, but skip if ECS Deployment Circuit Breaker is enabled
-            if (
-                not circuit_breaker_rollback
-                and max_retry > 0
-                and pri_task_def in stack_tasks_defs
-                and failedTasks >= max_retry
-            ):
-                istack.last_event_timestamp = event.timestamp
-                raise IboxErrorECSService(
-                    "ECS Service did not stabilize "
-                    f"[{failedTasks} >= {max_retry}] - "
-                    "cancelling update [ROLLBACK]"
-                )
-
-        time.sleep(5)
+        return events
+
+
+# tailer of the events after the last available one (ex. before an action)
+def get_tailer(istack):
+    tailer = event_tailer(istack)
+    tailer.skip()
+
+    return tailer
 
 
 # get timestamp from last event available
@@ -140,36 +71,105 @@ def get_last_timestamp(istack):
     return last_event.timestamp
 
 
-# show all events after specific timestamp and return last event timestamp
-def show(istack, timestamp, timedelta="0"):
-    event_iterator = istack.stack.events.all()
-    event_list = []
-    for event in event_iterator:
-        if event.timestamp > timestamp:
-            event_list.insert(0, event)
-        else:
-            break
+def _show_event(istack, event):
+    logtime = timegm(event.timestamp.timetuple())
+    istack.mylog(
+        event.logical_resource_id
+        + " "
+        + event.resource_status
+        + " "
+        + str(datetime.fromtimestamp(logtime))
+        + " "
+        + str(event.resource_status_reason)
+    )
+
+
+# show new events of tailer, return their number
+def show(istack, tailer, timedelta="0"):
+    event_list = tailer.get()
     for event in event_list:
-        logtime = timegm(event.timestamp.timetuple())
-        istack.mylog(
-            event.logical_resource_id
-            + " "
-            + event.resource_status
-            + " "
-            + str(datetime.fromtimestamp(logtime))
-            + " "
-            + str(event.resource_status_reason)
-        )
+        _show_event(istack, event)
         # show service depoyment logging
+        # (avoid showing current service log if is requested a stack past event)
         if (
             event.resource_type == "AWS::ECS::Service"
             and event.resource_status == "UPDATE_IN_PROGRESS"
             and event.resource_status_reason is None
             and istack.stack.stack_status not in istack.cfg.STACK_COMPLETE_STATUS
+            and timedelta == "0"
         ):
-            _show_service_update(istack, event, timedelta)
+            ecs_monitor.get(istack).add(istack, event)
 
-    if len(event_list) > 0:
-        return event_list.pop().timestamp
+    error = ecs_monitor.get_error(istack)
+    if error:
+        raise IboxErrorECSService(error)
 
-    return timestamp
+    return len(event_list)
+
+
+def _show_merged(stacks_events):
+    merged = heapq.merge(
+        *[[(n, e) for e in events] for n, events in stacks_events.items()],
+        key=lambda x: x[1].timestamp,
+    )
+    for istack, event in merged:
+        _show_event(istack, event)
+
+
+def _is_in_progress(istack):
+    return istack.stack.stack_status.endswith("_IN_PROGRESS")
+
+
+# Follow events of many stacks from one thread, merged in time order.
+# Stacks status is refreshed by the shared poller, events are tailed only
+# for stacks in progress (or just changed), at most LOG_MAX_TAILS_PER_POLL
+# for poll, least recently tailed first: api calls do not grow with the
+# number of stacks. In realtime (time_delta 0) follow while stacks are in
+# progress, if forever until interrupted
+def follow(istacks, time_delta, forever=False):
+    tailers = {}
+    for istack in istacks:
+        timestamp = get_last_timestamp(istack)
+        timestamp -= timedelta(seconds=time_delta if time_delta else 1)
+        tailers[istack] = event_tailer(istack, timestamp)
+
+    _show_merged({n: t.get() for n, t in tailers.items()})
+    if not forever and (time_delta or not any(_is_in_progress(n) for n in istacks)):
+        return
+
+    # one shared poller for region
+    pollers = {n: poller.get(n) for n in istacks}
+    watches = {n: pollers[n].subscribe(n.name, n.stack.stack_id) for n in istacks}
+    tailed = {n: 0 for n in istacks}
+    active = {n for n in istacks if _is_in_progress(n)}
+    policy = poll_policy(cfg.ACTION_WAITER_SLEEP_TIME)
+    changed = True
+    try:
+        while forever or active:
+            policy.sleep(changed)
+            for istack, watch in watches.items():
+                if watch.changed.is_set():
+                    watch.changed.clear()
+                    istack.stack.meta.data = watch.stack
+                    active.add(istack)
+
+            batch = sorted(active, key=lambda x: tailed[x])[
+                : cfg.LOG_MAX_TAILS_PER_POLL
+            ]
+            stacks_events = {}
+            changed = False
+            for istack in batch:
+                stacks_events[istack] = tailers[istack].get()
+                tailed[istack] = time.monotonic()
+                if not stacks_events[istack] and not _is_in_progress(istack):
+                    active.discard(istack)
+                if stacks_events[istack]:
+                    changed = True
+                    pollers[istack].wake()
+
+            _show_merged(stacks_events)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for istack, watch in watches.items():
+            pollers[istack].unsubscribe(watch)
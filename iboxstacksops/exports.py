@@ -0,0 +1,160 @@
+import threading
+from collections.abc import Mapping
+
+from . import logger, cfg, cache, stacks
+from .aws import myboto3
+
+_stats = {
+    "lookups": 0,
+    "scans": 0,
+}
+
+
+# {StackId: [StackStatus, LastUpdatedTime]} for all live stacks
+def _get_stacks_signature(client):
+    return {
+        s["StackId"]: [s["StackStatus"], s.get("LastUpdatedTime")]
+        for s in stacks.list_stacks(client).values()
+    }
+
+
+# exports with their exporting stack and its signature
+def _scan(client, signature):
+    exports = {}
+    paginator = client.get_paginator("list_exports")
+    response_iterator = paginator.paginate()
+    for e in response_iterator:
+        for export in e["Exports"]:
+            stack_id = export["ExportingStackId"]
+            exports[export["Name"]] = {
+                "Value": export["Value"],
+                "StackId": stack_id,
+                "Signature": signature.get(stack_id),
+            }
+
+    return exports
+
+
+# Read only mapping of exports resolved on demand.
+# A lookup hit the in-process memo, then the local exports cache (an entry
+# is valid while its exporting stack keeps the StackStatus/LastUpdatedTime
+# stored with it, so an updated stack invalidate only its exports) and
+# only on a miss do a full list_exports scan.
+# Scan is single-flight: concurrent stacks wait for the one in progress.
+class lazy_exports(Mapping):
+    def __init__(self, boto3):
+        self.boto3 = boto3
+        self.client = boto3.client("cloudformation")
+        self.memo = {}
+        self.stack_ids = {}
+        self.cached = None
+        # None while the local cache is fresh (within max_age)
+        self.signature = None
+        self.invalidated = set()
+        self.scanned = False
+        self.lock = threading.Lock()
+
+    # load local cache and current stacks signature, only once
+    def _load(self):
+        if self.cached is not None:
+            return
+
+        self.path = cache.get_path("exports", self.boto3)
+        cached = None if cfg.refresh else cache.load(self.path)
+
+        if not cache.is_fresh(cached, cfg.max_age):
+            self.signature = _get_stacks_signature(self.client)
+
+        self.cached = cached if cached else {"exports": {}}
+
+    def _get_cached(self, name):
+        entry = self.cached["exports"].get(name)
+        if not entry:
+            return
+
+        stack_id = entry["StackId"]
+        if stack_id in self.invalidated:
+            return
+        if self.signature is None:
+            return entry
+        signature = self.signature.get(stack_id)
+        if signature and signature == entry.get("Signature"):
+            return entry
+
+    def _scan(self):
+        logger.info("Getting CloudFormation Exports")
+        _stats["scans"] += 1
+        # exporting stacks changed since signature was taken (or not taken)
+        if self.signature is None or self.invalidated:
+            self.signature = _get_stacks_signature(self.client)
+        self.invalidated.clear()
+        exports = _scan(self.client, self.signature)
+        self.memo = {n: v["Value"] for n, v in exports.items()}
+        self.stack_ids = {n: v["StackId"] for n, v in exports.items()}
+        self.scanned = True
+        self.cached = {"exports": exports}
+        cache.save(self.path, self.cached)
+
+    def _scan_all(self):
+        with self.lock:
+            if not self.scanned:
+                self._load()
+                self._scan()
+
+    # a stack has been updated, drop its exports (memo and cached ones),
+    # next lookups of them will scan exports again
+    def invalidate(self, stack_name):
+        def is_stack(stack_id):
+            return stack_id.split("/")[1] == stack_name
+
+        with self.lock:
+            for name, stack_id in list(self.stack_ids.items()):
+                if is_stack(stack_id):
+                    self.memo.pop(name, None)
+                    del self.stack_ids[name]
+                    self.invalidated.add(stack_id)
+            if self.cached:
+                for entry in self.cached["exports"].values():
+                    if is_stack(entry["StackId"]):
+                        self.invalidated.add(entry["StackId"])
+            self.scanned = False
+
+    def __getitem__(self, name):
+        _stats["lookups"] += 1
+        try:
+            return self.memo[name]
+        except KeyError:
+            pass
+
+        with self.lock:
+            if name not in self.memo and not self.scanned:
+                self._load()
+                entry = self._get_cached(name)
+                if entry:
+                    self.memo[name] = entry["Value"]
+                    self.stack_ids[name] = entry["StackId"]
+                else:
+                    self._scan()
+
+        return self.memo[name]
+
+    def __iter__(self):
+        self._scan_all()
+        return iter(self.memo)
+
+    def __len__(self):
+        self._scan_all()
+        return len(self.memo)
+
+
+def get(obj=None):
+    if not obj:
+        boto3 = myboto3()
+    else:
+        boto3 = getattr(obj, "boto3")
+
+    return lazy_exports(boto3)
+
+
+def log_stats():
+    logger.debug(f"Exports: {_stats['lookups']} lookups, {_stats['scans']} scans")
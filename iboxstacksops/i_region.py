@@ -1,6 +1,6 @@
-from . import cfg, ssm, replica
+from . import cfg, ssm, replica, trace
 from .aws import myboto3
-from .tools import smodule_to_class
+from .tools import cfg_overlay
 
 
 class ibox_region(object):
@@ -20,7 +20,7 @@ class ibox_region(object):
         # self.cfg should contains parsed args
         # inside method processed by istack (in a parallel way)
         # i need to set attr to self.cfg and not to the common cfg
-        self.cfg = smodule_to_class(cfg)
+        self.cfg = cfg_overlay(cfg)
 
     def ssm_setup(self):
         result = ssm.setup(self)
@@ -49,6 +49,7 @@ class ibox_region(object):
 
 
 def exec_command(name, data, command, region=None, **kwargs):
-    iregion = ibox_region(name, data)
+    with trace.span(f"region.{command}", region=name):
+        iregion = ibox_region(name, data)
 
-    return getattr(iregion, command)(**kwargs)
+        return getattr(iregion, command)(**kwargs)
@@ -9,9 +9,10 @@ from . import (
     dashboard,
     ssm,
     route53,
+    trace,
 )
 from .aws import myboto3
-from .tools import smodule_to_class
+from .tools import cfg_overlay, run_sync
 from .msg import msg
 
 
@@ -35,7 +36,7 @@ class ibox_stack(object):
         # self.cfg should contains parsed args
         # inside method processed by istack (in a parallel way)
         # i need to set attr to self.cfg and not to the common cfg
-        self.cfg = smodule_to_class(cfg)
+        self.cfg = cfg_overlay(cfg)
 
         try:
             # try to get already inited msg client
@@ -44,32 +45,58 @@ class ibox_stack(object):
             # or init it
             self.cfg.MSG = msg()
 
-    def create(self):
+    # process template, parameters and resolve them
+    def _process(self):
         self.exports = self.cfg.exports
-        self.template = template.get_template(self)
+        with trace.span("template.get_template"):
+            self.template = template.get_template(self)
+        with trace.span("parameters.process"):
+            parameters.process(self)
+        with trace.span("resolve.process"):
+            resolve.process(self)
+
+    def create(self):
         self.c_parameters = {}
-        parameters.process(self)
-        resolve.process(self)
-        result = actions.create(self)
+        self._process()
+        with trace.span("actions.create"):
+            result = actions.create(self)
+        if result:
+            return {self.name: self.stack.stack_status}
+
+    async def create_async(self):
+        self.c_parameters = {}
+        await run_sync(self._process)
+        result = await actions.create_async(self)
         if result:
             return {self.name: self.stack.stack_status}
 
     def update(self):
         self.stack = self.cloudformation.Stack(self.name)
-        self.exports = self.cfg.exports
-        self.template = template.get_template(self)
-        parameters.process(self)
-        resolve.process(self)
-        result = actions.update(self)
+        self._process()
+        with trace.span("actions.update"):
+            result = actions.update(self)
 
         if result:
             self.stack.reload()
             return self.stack.stack_status
 
+    async def update_async(self):
+        self.stack = self.cloudformation.Stack(self.name)
+        await run_sync(self._process)
+        result = await actions.update_async(self)
+
+        if result:
+            await run_sync(self.stack.reload)
+            return self.stack.stack_status
+
     def delete(self):
         self.stack = self.cloudformation.Stack(self.name)
         actions.delete(self)
 
+    async def delete_async(self):
+        self.stack = self.cloudformation.Stack(self.name)
+        await actions.delete_async(self)
+
     def cancel_update(self):
         self.stack = self.cloudformation.Stack(self.name)
         result = actions.cancel_update(self)
@@ -78,6 +105,14 @@ class ibox_stack(object):
             self.stack.reload()
             return self.stack.stack_status
 
+    async def cancel_update_async(self):
+        self.stack = self.cloudformation.Stack(self.name)
+        result = await actions.cancel_update_async(self)
+
+        if result:
+            await run_sync(self.stack.reload)
+            return self.stack.stack_status
+
     def continue_update(self):
         self.stack = self.cloudformation.Stack(self.name)
         result = actions.continue_update(self)
@@ -86,6 +121,14 @@ class ibox_stack(object):
             self.stack.reload()
             return self.stack.stack_status
 
+    async def continue_update_async(self):
+        self.stack = self.cloudformation.Stack(self.name)
+        result = await actions.continue_update_async(self)
+
+        if result:
+            await run_sync(self.stack.reload)
+            return self.stack.stack_status
+
     def rollback(self):
         self.stack = self.cloudformation.Stack(self.name)
         result = actions.rollback(self)
@@ -94,6 +137,14 @@ class ibox_stack(object):
             self.stack.reload()
             return self.stack.stack_status
 
+    async def rollback_async(self):
+        self.stack = self.cloudformation.Stack(self.name)
+        result = await actions.rollback_async(self)
+
+        if result:
+            await run_sync(self.stack.reload)
+            return self.stack.stack_status
+
     def parameters(self, check=None):
         self.exports = self.cfg.exports
         self.template = template.get_template(self)
@@ -137,6 +188,7 @@ class ibox_stack(object):
     def replicate(self, ssm_map, iregion):
         self.cfg.exports = iregion.cfg.exports
         self.cfg.stacks = iregion.cfg.stacks
+        self.cfg.single_stack = iregion.cfg.single_stack
         # pprint(ssm_map)
         for n, v in ssm_map.items():
             if n.startswith(f"{self.name}/"):
@@ -175,17 +227,26 @@ class ibox_stack(object):
         result = route53.create(self)
         return result
 
-    def stackset_update(self):
-        cfg.fields = cfg.STACKSET_INSTANCES_SHOW_TABLE_FIELDS
+    def _process_stackset(self):
+        self.cfg.fields = cfg.STACKSET_INSTANCES_SHOW_TABLE_FIELDS
         self.exports = self.cfg.exports
         self.template = template.get_template(self, stackset=True)
         self.stack = True
         parameters.process(self)
         resolve.process(self)
+
+    def stackset_update(self):
+        self._process_stackset()
         result = actions.stackset_update(self)
         if result:
             return {self.name: None}
 
+    async def stackset_update_async(self):
+        await run_sync(self._process_stackset)
+        result = await actions.stackset_update_async(self)
+        if result:
+            return {self.name: None}
+
     def stackset_info(self):
         self.exports = self.cfg.exports
         self.template = template.get_template(self, stackset=True)
@@ -205,12 +266,24 @@ class ibox_stack(object):
         actions.stackset_show(self)
 
     def stackset_instances(self):
-        cfg.fields = cfg.STACKSET_INSTANCES_SHOW_TABLE_FIELDS
+        self.cfg.fields = cfg.STACKSET_INSTANCES_SHOW_TABLE_FIELDS
         cfg.output = "text"
         actions.stackset_instances(self)
 
 
 def exec_command(name, data, command, region=None, **kwargs):
-    istack = ibox_stack(name, data, region)
+    with trace.span(f"stack.{command}", stack=name, region=region):
+        istack = ibox_stack(name, data, region)
+
+        return getattr(istack, command)(**kwargs)
+
+
+# as exec_command, for the asyncio engine: commands with an async version
+# are awaited, the others run in the loop executor
+async def exec_command_async(name, data, command, region=None, **kwargs):
+    istack = await run_sync(ibox_stack, name, data, region)
+    method = getattr(istack, f"{command}_async", None)
+    if method:
+        return await method(**kwargs)
 
-    return getattr(istack, command)(**kwargs)
+    return await run_sync(getattr(istack, command), **kwargs)
@@ -1,27 +1,52 @@
 import argparse
+import importlib
 
 from . import cfg, __version__
-from .commands import (
-    create,
-    update,
-    delete,
-    cancel_update,
-    continue_update,
-    rollback,
-    info,
-    show_resources,
-    parameters,
-    resolve,
-    show_table,
-    log,
-    dash,
-    ssm_setup,
-    ssm_put,
-    ssm_show,
-    r53,
-    replicate,
-    stackset,
-)
+
+
+# argparse type for a number of stacks or a percentage of them (ex. 10%)
+def count_or_percentage(value):
+    try:
+        number = float(value[:-1]) if value.endswith("%") else int(value)
+    except ValueError:
+        number = -1
+
+    if not 0 <= number < float("inf"):
+        raise argparse.ArgumentTypeError(
+            f"invalid value: '{value}' - use a number or a percentage [ex. 10%]"
+        )
+
+    return value
+
+
+# argparse type for an interval in seconds, greater than 0
+def positive_float(value):
+    try:
+        number = float(value)
+    except ValueError:
+        number = 0
+
+    if not 0 < number < float("inf"):
+        raise argparse.ArgumentTypeError(
+            f"invalid value: '{value}' - use a number greater than 0"
+        )
+
+    return number
+
+
+# argparse type for a fraction, from 0 included to 1 excluded
+def fraction(value):
+    try:
+        number = float(value)
+    except ValueError:
+        number = -1
+
+    if not 0 <= number < 1:
+        raise argparse.ArgumentTypeError(
+            f"invalid value: '{value}' - use a number from 0 to less than 1"
+        )
+
+    return number
 
 
 def get_create_parser(subparser, parents=[]):
@@ -61,6 +86,28 @@ def get_update_parser(subparser, parents=[]):
     #        action="store_true",
     #    )
     parser.add_argument("--dryrun", help="Show changeset and exit", action="store_true")
+    order_group = parser.add_mutually_exclusive_group()
+    order_group.add_argument(
+        "--dag",
+        help="Update stacks following their export/import dependencies, "
+        "starting a stack as soon as the ones it imports from completed",
+        action="store_true",
+    )
+    order_group.add_argument(
+        "--waves",
+        help="Update stacks in waves, values are the cumulative number "
+        "or percentage of stacks at the end of each wave, then the rest "
+        "[ex. 1 10%% 50%%]",
+        nargs="+",
+        type=count_or_percentage,
+        default=[],
+    )
+    parser.add_argument(
+        "--wave-max-failures",
+        help="Halt waves when more stacks (number or percentage) failed",
+        type=count_or_percentage,
+        default=cfg.wave_max_failures,
+    )
     parser.add_argument(
         "--silent-update", help="Show only final result", action="store_true"
     )
@@ -87,7 +134,7 @@ def set_dash_parser(subparser, parents=[]):
     parser = subparser.add_parser(
         "dash", parents=parents, help="Create DashBoard for stacks"
     )
-    parser.set_defaults(func=dash)
+    parser.set_defaults(func="dash")
 
     parser.add_argument(
         "--statistic",
@@ -147,7 +194,7 @@ def set_ssm_parser(subparser, parents=[]):
     )
     # setup
     setup_parser = ssm_parser.add_parser("setup", help="Setup Regions", parents=parents)
-    setup_parser.set_defaults(func=ssm_setup, no_stacks=True)
+    setup_parser.set_defaults(func="ssm_setup", no_stacks=True)
 
     setup_parser.add_argument(
         "-R",
@@ -160,7 +207,7 @@ def set_ssm_parser(subparser, parents=[]):
     )
     # put
     put_parser = ssm_parser.add_parser("put", help="Put Parameters", parents=parents)
-    put_parser.set_defaults(func=ssm_put)
+    put_parser.set_defaults(func="ssm_put")
 
     put_parser.add_argument(
         "-R", "--regions", help="Regions", type=str, default=[], nargs="+"
@@ -169,12 +216,12 @@ def set_ssm_parser(subparser, parents=[]):
     show_parser = ssm_parser.add_parser(
         "show", help="Show Regions Distribution", parents=parents
     )
-    show_parser.set_defaults(func=ssm_show, all_stacks=True)
+    show_parser.set_defaults(func="ssm_show", all_stacks=True)
 
 
 def set_stackset_parser(subparser, parents=[]):
     parser = subparser.add_parser("stackset", parents=[], help="StackSet operations")
-    parser.set_defaults(func=stackset)
+    parser.set_defaults(func="stackset")
 
     stackset_parser = parser.add_subparsers(
         title="Stackset Commands", required=True, dest="command_stackset"
@@ -230,7 +277,7 @@ def set_replicate_parser(subparser, parents=[]):
     parser = subparser.add_parser(
         "replicate", parents=[], help="Replicate in Regions configured by SSM"
     )
-    parser.set_defaults(func=replicate)
+    parser.set_defaults(func="replicate")
 
     replicate_parser = parser.add_subparsers(
         title="Replicate Command", required=True, dest="command_replicate"
@@ -287,7 +334,7 @@ def set_r53_parser(subparser, parents=[]):
         parents=parents,
         help="Create RecordSet Aliases looking at stack R53 resources",
     )
-    parser.set_defaults(func=r53)
+    parser.set_defaults(func="r53")
 
     parser.add_argument("--dryrun", help="Show changes and exit", action="store_true")
     parser.add_argument(
@@ -321,7 +368,7 @@ def get_stack_selection_parser():
         "-s",
         "--stack",
         nargs="+",
-        help="Stack Names space separated",
+        help="Stack Names space separated - shell-style wildcards are allowed",
         type=str,
         default=[],
     )
@@ -341,6 +388,22 @@ def get_stack_selection_parser():
         type=str,
         default=[],
     )
+    parser.add_argument(
+        "--env",
+        nargs="+",
+        help="Filter selected Stacks by Envs space separated - "
+        "stacks, roles and types are added together, envs and tags filter them",
+        type=str,
+        default=[],
+    )
+    parser.add_argument(
+        "--tag",
+        nargs="+",
+        help="Filter selected Stacks by Tags space separated, "
+        "stacks must have all of them - use syntax: Key=Value",
+        type=str,
+        default=[],
+    )
 
     return parser
 
@@ -433,6 +496,18 @@ def get_parser():
     # common parser
     parser.add_argument("--region", help="Region", type=str)
     parser.add_argument("--profile", help="AWS Profile", type=str)
+    parser.add_argument(
+        "--refresh",
+        help="Ignore and rebuild local stacks discovery cache",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-age",
+        help="Use local stacks discovery cache, without checking for changed stacks, "
+        "if younger than seconds - default to 0 (always check)",
+        type=int,
+        default=cfg.max_age,
+    )
     parser.add_argument(
         "--compact", help="Display Stacks-Output in compact form", action="store_true"
     )
@@ -442,6 +517,106 @@ def get_parser():
         help="Max Concurrent jobs - default to number of stacks",
         type=int,
     )
+    parser.add_argument(
+        "--region-jobs",
+        help="Max Concurrent jobs for each region (replicate/ssm)",
+        type=int,
+    )
+    parser.add_argument(
+        "--engine",
+        help="Execution engine for concurrent jobs - async run stacks "
+        "actions as coroutines, waiting without holding a thread, and "
+        f"aws calls on up to {cfg.ASYNC_ENGINE_MAX_WORKERS} threads - "
+        "--dag, --waves and serial jobs always use thread",
+        choices=["thread", "async"],
+        default=cfg.engine,
+    )
+    parser.add_argument(
+        "--api-rate",
+        help="Max AWS API calls per second for region/service/operation "
+        "family, concurrency adapt to throttling - default 0: disabled",
+        type=float,
+        default=cfg.api_rate,
+    )
+    parser.add_argument(
+        "--api-stats",
+        help="Show AWS API calls, retries, throttles and latency report",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--api-stats-file",
+        help="Write AWS API calls report, for operation and stack, to json file",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Write phase spans, for stack, to trace file "
+        "[open it with chrome://tracing or Perfetto]",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--trace-format",
+        help="Trace file format",
+        choices=["chrome", "otlp"],
+        default=cfg.trace_format,
+    )
+    parser.add_argument(
+        "--poll-policy",
+        help="Waiters polling - adaptive start from floor, back off up to "
+        "ceiling while nothing changes and snap back on changes",
+        choices=["adaptive", "fixed"],
+        default=cfg.poll_policy,
+    )
+    parser.add_argument(
+        "--poll-floor",
+        help="Adaptive polling min interval in seconds",
+        type=positive_float,
+        default=cfg.poll_floor,
+    )
+    parser.add_argument(
+        "--poll-ceiling",
+        help="Adaptive polling max interval in seconds, not less than floor",
+        type=positive_float,
+        default=cfg.poll_ceiling,
+    )
+    parser.add_argument(
+        "--poll-jitter",
+        help="Polling interval jitter, as a fraction of the interval [0-1)",
+        type=fraction,
+        default=cfg.poll_jitter,
+    )
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument(
+        "--record",
+        help="Record AWS API calls to cassette file (.gz to compress)",
+        metavar="FILE",
+    )
+    cassette_group.add_argument(
+        "--replay",
+        help="Replay AWS API calls from cassette file, offline",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--simulate",
+        help="Use a synthetic account with N iBox stacks instead of AWS",
+        type=int,
+        metavar="N",
+        default=cfg.simulate,
+    )
+    parser.add_argument(
+        "--simulate-throttle",
+        help="Probability of a throttled attempt for simulated calls",
+        type=float,
+        metavar="P",
+        default=cfg.simulate_throttle,
+    )
+    parser.add_argument(
+        "--time-scale",
+        help="Scale waiters sleep time - 0 to not wait - "
+        "only with --replay or --simulate",
+        type=float,
+        default=cfg.time_scale,
+    )
     parser.add_argument(
         "--pause",
         help="Pause for seconds between jobs - "
@@ -460,7 +635,9 @@ def get_parser():
     action_parser.add_argument(
         "-y",
         "--answer-yes",
-        help="Answer YES (No Confirm)",
+        help="Answer YES (No Confirm) - update with role/type/tag/env starts "
+        "updating stacks while they are discovered, without showing "
+        "the changeset even if only one stack matches",
         required=False,
         action="store_true",
     )
@@ -500,7 +677,7 @@ def get_parser():
             create_update_parser,
         ],
     )
-    parser_create.set_defaults(func=create)
+    parser_create.set_defaults(func="create")
 
     # update parser
     parser_update = get_update_parser(
@@ -512,7 +689,7 @@ def get_parser():
             create_update_parser,
         ],
     )
-    parser_update.set_defaults(func=update)
+    parser_update.set_defaults(func="update")
 
     # delete parser
     parser_delete = command_subparser.add_parser(
@@ -520,7 +697,7 @@ def get_parser():
         parents=[action_parser, stack_single_parser],
         help="Delete Stack (WARNING)",
     )
-    parser_delete.set_defaults(func=delete)
+    parser_delete.set_defaults(func="delete")
 
     # cancel_update parser
     parser_cancel = command_subparser.add_parser(
@@ -528,7 +705,7 @@ def get_parser():
         parents=[action_parser, stack_selection_parser],
         help="Cancel Update Stack",
     )
-    parser_cancel.set_defaults(func=cancel_update)
+    parser_cancel.set_defaults(func="cancel_update")
 
     # continue_update parser
     parser_continue = command_subparser.add_parser(
@@ -536,7 +713,7 @@ def get_parser():
         parents=[action_parser, stack_selection_parser],
         help="Continue Update RollBack",
     )
-    parser_continue.set_defaults(func=continue_update)
+    parser_continue.set_defaults(func="continue_update")
     parser_continue.add_argument(
         "--resources_to_skip", help="Resource to Skip", default=[], nargs="+"
     )
@@ -547,13 +724,13 @@ def get_parser():
         parents=[action_parser, stack_selection_parser],
         help="RollBack to the last known stable state",
     )
-    parser_rollback.set_defaults(func=rollback)
+    parser_rollback.set_defaults(func="rollback")
 
     # info parser
     parser_info = command_subparser.add_parser(
         "info", parents=[stack_selection_parser], help="Show Stack Info"
     )
-    parser_info.set_defaults(func=info)
+    parser_info.set_defaults(func="info")
 
     # resources parser
     parser_resources = command_subparser.add_parser(
@@ -571,7 +748,7 @@ def get_parser():
     parser_resources.add_argument(
         "-O", "--output", type=str, default="text", choices=["text", "html", "bare"]
     )
-    parser_resources.set_defaults(func=show_resources)
+    parser_resources.set_defaults(func="show_resources")
 
     # parameters parser
     parser_parameters = command_subparser.add_parser(
@@ -579,7 +756,7 @@ def get_parser():
         parents=[template_parser_update, stack_selection_parser],
         help="Show Available Stack Parameters",
     )
-    parser_parameters.set_defaults(func=parameters)
+    parser_parameters.set_defaults(func="parameters")
 
     # resolve parser
     parser_resolve = command_subparser.add_parser(
@@ -587,7 +764,7 @@ def get_parser():
         parents=[template_parser_update, stack_selection_parser],
         help="Resolve Stack template - output in yaml short format",
     )
-    parser_resolve.set_defaults(func=resolve)
+    parser_resolve.set_defaults(func="resolve")
     parser_resolve.add_argument(
         "-W",
         "--write-path",
@@ -597,9 +774,9 @@ def get_parser():
 
     # log parser
     parser_log = command_subparser.add_parser(
-        "log", parents=[stack_single_parser], help="Show Stack Log"
+        "log", parents=[stack_selection_parser], help="Show Stacks Log"
     )
-    parser_log.set_defaults(func=log)
+    parser_log.set_defaults(func="log")
     parser_log.add_argument(
         "-d",
         "--timedelta",
@@ -607,6 +784,13 @@ def get_parser():
         "use 0 for realtime - if < 30 assume days",
         default=cfg.timedelta,
     )
+    parser_log.add_argument(
+        "-f",
+        "--follow",
+        help="Follow new events until interrupted",
+        action="store_true",
+        default=cfg.follow,
+    )
 
     # dashboard parser
     set_dash_parser(
@@ -623,7 +807,7 @@ def get_parser():
             stack_selection_parser,
         ],
     )
-    parser_show.set_defaults(func=show_table, all_stacks=True)
+    parser_show.set_defaults(func="show_table", all_stacks=True)
 
     # stackset parser
     set_stackset_parser(
@@ -674,12 +858,29 @@ def set_cfg(argv):
     for n, v in vars(args[0]).items():
         setattr(cfg, n, v)
 
+    # against aws a scaled wait would poll it in a tight loop
+    if cfg.time_scale != 1 and not (cfg.replay or cfg.simulate):
+        parser.error("--time-scale can be used only with --replay or --simulate")
+    if cfg.time_scale < 0:
+        parser.error("--time-scale must be >= 0")
+    if cfg.poll_ceiling < cfg.poll_floor:
+        parser.error("--poll-ceiling must be >= --poll-floor")
+    # dependents and waves start only after the stacks completed
+    if cfg.nowait and (cfg.dag or cfg.waves):
+        parser.error("--nowait can not be used with --dag or --waves")
+
+    # commands (and aws libs) are imported only now, when needed
+    commands = importlib.import_module(".commands", __package__)
+    cfg.func = getattr(commands, cfg.func)
+
     # trick for showing ALL Stacks
     # if nor stack nor role nor type are specified.
-    if cfg.all_stacks and not (cfg.stack or cfg.role or cfg.type):
+    if cfg.all_stacks and not (cfg.stack or cfg.role or cfg.type or cfg.tag or cfg.env):
         cfg.type = ["ALL"]
 
-    if not cfg.no_stacks and not (cfg.stack or cfg.role or cfg.type):
+    if not cfg.no_stacks and not (
+        cfg.stack or cfg.role or cfg.type or cfg.tag or cfg.env
+    ):
         parser.print_help()
         exit(0)
 
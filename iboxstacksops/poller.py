@@ -0,0 +1,205 @@
+import time
+import threading
+from functools import partial
+
+from . import logger, cfg, trace
+from .tools import poll_policy
+
+# One background poller for region refresh the status of all the stacks
+# waited by update waiters, with a single paginated describe_stacks sweep
+# (or describing them one by one, if they are less than the pages of
+# the last sweep).
+# Waiters subscribe a watch and are woken only when their stack status or
+# LastUpdatedTime changed.
+
+_pollers = {}
+_lock = threading.Lock()
+
+
+def _get_signature(stack):
+    return stack["StackStatus"], stack.get("LastUpdatedTime")
+
+
+# {stack_id: watches}, a stack can be waited by nested waiters
+def _get_stacks(watches):
+    stacks = {}
+    for watch in watches:
+        stacks.setdefault(watch.stack_id, []).append(watch)
+
+    return stacks
+
+
+class stack_watch(object):
+    def __init__(self, name, stack_id):
+        self.name = name
+        self.stack_id = stack_id
+        self.stack = None
+        self.signature = None
+        self.refreshed = time.monotonic()
+        self.changed = threading.Event()
+        # asyncio engine waiter wake up, called on changes
+        self.on_change = None
+
+    # return True if stack changed
+    def update(self, stack):
+        self.refreshed = time.monotonic()
+        signature = _get_signature(stack)
+        if signature == self.signature:
+            return False
+
+        self.stack = stack
+        self.signature = signature
+        self.changed.set()
+        if self.on_change:
+            self.on_change()
+
+        return True
+
+    # wait for a change, return the stack description or None on timeout
+    def wait(self, timeout):
+        if not self.changed.wait(timeout * cfg.time_scale):
+            return
+        self.changed.clear()
+
+        return self.stack
+
+    # as wait, for the asyncio engine: the poller thread wake up the loop
+    async def wait_async(self, timeout):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        self.on_change = partial(loop.call_soon_threadsafe, woken.set)
+        try:
+            if not self.changed.is_set():
+                await asyncio.wait_for(woken.wait(), timeout * cfg.time_scale)
+        except asyncio.TimeoutError:
+            return
+        finally:
+            self.on_change = None
+        self.changed.clear()
+
+        return self.stack
+
+    def is_stale(self):
+        stale_time = cfg.POLLER_STALE_TIME * cfg.time_scale
+
+        return time.monotonic() - self.refreshed > stale_time
+
+
+class stack_poller(object):
+    def __init__(self, client):
+        self.client = client
+        self.watches = set()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.pages = 0
+        self.woken = False
+        self.policy = poll_policy(cfg.ACTION_WAITER_SLEEP_TIME)
+
+    def subscribe(self, name, stack_id):
+        watch = stack_watch(name, stack_id)
+        with self.cond:
+            self.watches.add(watch)
+            self.woken = True
+            if not self.thread:
+                self.thread = threading.Thread(
+                    target=self._run, name="stack-poller", daemon=True
+                )
+                self.thread.start()
+
+        return watch
+
+    # poll as soon as possible, ex. waiter got new stack events
+    def wake(self):
+        with self.cond:
+            self.woken = True
+            self.cond.notify_all()
+
+    def unsubscribe(self, watch):
+        with self.cond:
+            self.watches.discard(watch)
+            self.cond.notify_all()
+
+    def _describe(self, stacks):
+        changed = False
+        for stack_id, watches in stacks.items():
+            response = self.client.describe_stacks(StackName=stack_id)
+            for watch in watches:
+                changed = watch.update(response["Stacks"][0]) or changed
+
+        return changed
+
+    def _sweep(self, stacks):
+        pending = dict(stacks)
+        paginator = self.client.get_paginator("describe_stacks")
+        changed = False
+        self.pages = 0
+        for page in paginator.paginate():
+            self.pages += 1
+            for stack in page["Stacks"]:
+                for watch in pending.pop(stack["StackId"], []):
+                    changed = watch.update(stack) or changed
+            if not pending:
+                return changed
+
+        # deleted stacks are not listed, describe them by id
+        return self._describe(pending) or changed
+
+    # return True if any stack changed
+    def _poll(self):
+        with self.cond:
+            stacks = _get_stacks(self.watches)
+        if not stacks:
+            return False
+
+        try:
+            with trace.span("poller.sweep", stacks=len(stacks)):
+                if len(stacks) <= max(cfg.POLLER_SINGLE_MAX_STACKS, self.pages):
+                    return self._describe(stacks)
+                else:
+                    return self._sweep(stacks)
+        except Exception as e:
+            # keep polling, waiters reload stale stacks meanwhile
+            logger.warning(f"Stacks poller: {e}")
+
+        return False
+
+    def _run(self):
+        try:
+            while True:
+                start = time.monotonic()
+                changed = self._poll()
+                with self.cond:
+                    # new waited stacks (just after an action) and new stack
+                    # events count as changes
+                    changed = changed or self.woken
+                    self.woken = False
+                    deadline = start + self.policy.next(changed) * cfg.time_scale
+                    while self.watches:
+                        if self.woken:
+                            # but do not poll more often than policy floor
+                            floor = self.policy.floor * cfg.time_scale
+                            deadline = min(deadline, start + floor)
+                        timeout = deadline - time.monotonic()
+                        if timeout <= 0:
+                            break
+                        self.cond.wait(timeout)
+                    if not self.watches:
+                        self.thread = None
+                        return
+        finally:
+            # on errors too, let next subscribe start a new thread
+            with self.cond:
+                if self.thread is threading.current_thread():
+                    self.thread = None
+
+
+def get(istack):
+    key = (istack.boto3.profile, istack.boto3.region_name)
+
+    with _lock:
+        if key not in _pollers:
+            _pollers[key] = stack_poller(istack.client)
+
+    return _pollers[key]
@@ -0,0 +1,162 @@
+import re
+import time
+import threading
+
+from . import logger, cfg
+
+THROTTLING_ERROR_CODES = [
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottledException",
+    "RequestThrottled",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "ProvisionedThroughputExceededException",
+    "SlowDown",
+]
+
+# context key for throttled attempts of calls served without botocore
+# retries (ex. by the simulator)
+THROTTLES_CONTEXT_KEY = "ibox_throttles"
+
+_buckets = {}
+_lock = threading.Lock()
+
+
+# Token bucket with an adaptive limit of in flight calls (AIMD):
+# a throttle halve the limit, a successful call grow it back by 1/limit
+# (about one more concurrent call per limit successful calls).
+class token_bucket(object):
+    def __init__(self, rate, burst, max_inflight):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.max_inflight = max_inflight
+        self.limit = float(max_inflight)
+        self.inflight = 0
+        self.calls = 0
+        self.throttles = 0
+        self.cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                if self.inflight < int(self.limit):
+                    self._refill()
+                    if self.tokens >= 1:
+                        break
+                    self.cond.wait((1 - self.tokens) / self.rate)
+                else:
+                    self.cond.wait()
+
+            self.tokens -= 1
+            self.inflight += 1
+            self.calls += 1
+
+    def release(self):
+        with self.cond:
+            self.inflight -= 1
+            self.cond.notify_all()
+
+    def on_success(self):
+        with self.cond:
+            self.limit = min(self.max_inflight, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+    def on_throttle(self):
+        with self.cond:
+            self.throttles += 1
+            self.limit = max(1.0, self.limit / 2)
+
+
+# operation family is the operation verb: Describe, List, Get, Update...
+def _get_family(operation):
+    match = re.match(r"[A-Z][a-z]+", operation)
+
+    return match.group(0) if match else operation
+
+
+def _get_bucket(region, service, operation):
+    key = (region, service, _get_family(operation))
+
+    try:
+        return _buckets[key]
+    except KeyError:
+        pass
+
+    with _lock:
+        if key not in _buckets:
+            _buckets[key] = token_bucket(
+                cfg.api_rate,
+                cfg.API_RATE_BURST,
+                cfg.jobs if cfg.jobs else cfg.API_MAX_INFLIGHT,
+            )
+
+    return _buckets[key]
+
+
+def is_throttle(parsed):
+    code = parsed.get("Error", {}).get("Code") if parsed else None
+
+    return code in THROTTLING_ERROR_CODES
+
+
+# hook limiter into client calls using botocore events
+def register(client):
+    if not cfg.api_rate or cfg.replay:
+        return
+
+    region = client.meta.region_name
+    service = client.meta.service_model.service_name
+    service_id = client.meta.service_model.service_id.hyphenize()
+    events = client.meta.events
+    context_key = "ibox_ratelimit"
+
+    def before_call(model, context, **kwargs):
+        bucket = _get_bucket(region, service, model.name)
+        bucket.acquire()
+        context[context_key] = bucket
+
+    # called for every attempt, botocore retries included
+    def needs_retry(response, request_dict, **kwargs):
+        bucket = request_dict.get("context", {}).get(context_key)
+        if bucket and response and is_throttle(response[1]):
+            bucket.on_throttle()
+
+    def after_call(http_response, parsed, context, **kwargs):
+        bucket = context.pop(context_key, None)
+        if not bucket:
+            return
+        for _ in range(context.get(THROTTLES_CONTEXT_KEY, 0)):
+            bucket.on_throttle()
+        if http_response.status_code < 300:
+            bucket.on_success()
+        bucket.release()
+
+    def after_call_error(context, **kwargs):
+        bucket = context.pop(context_key, None)
+        if bucket:
+            bucket.release()
+
+    events.register(f"before-call.{service_id}", before_call)
+    events.register(f"needs-retry.{service_id}", needs_retry)
+    events.register(f"after-call.{service_id}", after_call)
+    events.register(f"after-call-error.{service_id}", after_call_error)
+
+
+def log_stats():
+    for (region, service, family), bucket in sorted(_buckets.items()):
+        if not bucket.throttles:
+            continue
+        logger.warning(
+            f"Throttled {region} {service} {family}: "
+            f"{bucket.throttles} of {bucket.calls} calls, "
+            f"concurrency limit {int(bucket.limit)}"
+        )
@@ -1,11 +1,11 @@
-from . import stacks, i_stack, table
-from .tools import concurrent_exec, get_exports
+from . import stacks, exports, i_stack, table
+from .tools import concurrent_exec
 
 
 def create(iregion):
     name = iregion.cfg.stack[0]
     stack = i_stack.ibox_stack(name, {}, region=iregion.name)
-    iregion.cfg.exports = get_exports(obj=iregion)
+    iregion.cfg.exports = exports.get(obj=iregion)
     result = stack.replicate(ssm_map=iregion.ssm_map, iregion=iregion)
     if result:
         print(result)
@@ -16,7 +16,8 @@ def create(iregion):
 def update(iregion):
     w_stacks = stacks.get(obj=iregion)
     iregion.cfg.stacks = list(w_stacks.keys())
-    iregion.cfg.exports = get_exports(obj=iregion)
+    iregion.cfg.single_stack = len(w_stacks) == 1
+    iregion.cfg.exports = exports.get(obj=iregion)
     result = concurrent_exec(
         "replicate",
         w_stacks,
@@ -1,11 +1,68 @@
 import botocore
-import yaml
 import os
+import threading
 from pprint import pprint
 from collections import OrderedDict
 from pathlib import Path
 
-from . import logger, IboxError
+from . import logger, cache, trace, IboxError
+
+URL_SUFFIXES = {
+    "aws-cn": "amazonaws.com.cn",
+    "aws-iso": "c2s.ic.gov",
+    "aws-iso-b": "sc2s.sgov.gov",
+}
+
+
+def yaml_exclamation_mark(dumper, data):
+    if data.startswith(("!Ref", "!GetAtt", "!GetAZs")):
+        tag = data.split(" ")[0]
+        value = dumper.represent_scalar(tag, data.replace(f"{tag} ", ""))
+    else:
+        value = dumper.represent_scalar("tag:yaml.org,2002:str", data)
+
+    return value
+
+
+_pseudo_parameters = {}
+_pseudo_parameters_lock = threading.Lock()
+
+
+# account/region pseudo parameters, resolved once for (profile, region)
+def _get_region_pseudo_parameters(istack):
+    key = (istack.boto3.profile, istack.boto3.region_name)
+
+    with _pseudo_parameters_lock:
+        if key not in _pseudo_parameters:
+            region = istack.boto3.region_name
+            partition = istack.boto3.boto3.get_partition_for_region(region)
+            _pseudo_parameters[key] = {
+                "AWS::AccountId": cache.get_account_id(istack.boto3),
+                "AWS::Partition": partition,
+                "AWS::Region": region,
+                "AWS::URLSuffix": URL_SUFFIXES.get(partition, "amazonaws.com"),
+            }
+
+    return _pseudo_parameters[key]
+
+
+# pseudo parameters known before the stack is updated
+def get_pseudo_parameters(istack):
+    return dict(
+        _get_region_pseudo_parameters(istack), **{"AWS::StackName": istack.name}
+    )
+
+
+# return pseudo parameter value or None if not known
+def _get_pseudo_parameter(istack, name):
+    if name == "AWS::StackName":
+        return istack.name
+    if name == "AWS::StackId":
+        return istack.stack.stack_id if istack.stack else None
+    if name == "AWS::NotificationARNs":
+        return istack.cfg.topics
+
+    return _get_region_pseudo_parameters(istack).get(name)
 
 
 def _process_template(istack):
@@ -89,10 +146,10 @@ def _process_template(istack):
                 replace_to = r_value
             elif key in istack.r_parameters:
                 replace_to = istack.r_parameters[key]
-            elif key == "AWS::Region":
-                replace_to = istack.boto3.region_name
-            elif key == "AWS::AccountId":
-                replace_to = istack.boto3.client("sts").get_caller_identity()["Account"]
+            elif key.startswith("AWS::") and key != "AWS::NoValue":
+                replace_to = _get_pseudo_parameter(istack, key)
+                if replace_to is None:
+                    replace_to = key
             else:
                 replace_to = key
 
@@ -109,8 +166,10 @@ def _process_template(istack):
         return _recursive_resolve(name, value)
 
     def _resolve_ref(name, v):
-        if v == "AWS::Region":
-            value = istack.boto3.region_name
+        if v.startswith("AWS::") and v != "AWS::NoValue":
+            value = _get_pseudo_parameter(istack, v)
+            if value is None:
+                value = f"!Ref {v}"
         elif v in istack.r_parameters:
             value = istack.r_parameters[v]
             if istack.parameters.get(v, {}).get("Type") == "CommaDelimitedList":
@@ -313,6 +372,10 @@ def _do_check(istack):
 
 
 def show(istack):
+    import yaml
+
+    yaml.add_representer(str, yaml_exclamation_mark)
+
     _process_template(istack)
     logger.info(f"Resolved: {istack.name}")
 
@@ -354,7 +417,8 @@ def process(istack):
 
     try:
         _process_template(istack)
-        _do_check(istack)
+        with trace.span("resolve.check_s3_ecr"):
+            _do_check(istack)
     except IboxError:
         raise
     except Exception as e:
@@ -0,0 +1,595 @@
+import time
+import json
+import random
+import copy
+import threading
+from datetime import datetime, timezone, timedelta
+from botocore.awsrequest import AWSResponse
+
+from . import logger, cfg
+from .ratelimit import THROTTLES_CONTEXT_KEY
+
+# Synthetic account for scale benchmarks, seeded with cfg.simulate
+# iBox-style stacks. Clients calls are served by a botocore before-call
+# hook, with simulated latency, stack update timing and throttling.
+
+ACCOUNT_ID = "123456789012"
+PAGE_SIZE = 100
+ENVS = ["dev", "stg", "prd"]
+STACKS_FOR_ROLE = 20
+# botocore default attempts and base backoff for throttled calls
+MAX_ATTEMPTS = 5
+BACKOFF_TIME = 0.05
+
+_account = None
+_lock = threading.RLock()
+stats = {
+    "calls": 0,
+    "throttles": 0,
+    "unhandled": 0,
+}
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _scaled(seconds):
+    return seconds * cfg.time_scale
+
+
+class simulated_error(Exception):
+    def __init__(self, code, message, status=400):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+
+
+def _paginate(items, params, key, token="NextToken"):
+    start = int(params.get(token, 0) or 0)
+    page = items[start : start + PAGE_SIZE]
+    response = {key: page}
+    if start + PAGE_SIZE < len(items):
+        response[token] = str(start + PAGE_SIZE)
+
+    return response
+
+
+class account(object):
+    def __init__(self, n_stacks, region):
+        self.region = region
+        self.random = random.Random(n_stacks)
+        self.stacks = {}
+        self.templates = {}
+        self.resources = {}
+        self.events = {}
+        self.pending_events = {}
+        self.exports = {}
+        self.ssm = {}
+        self.dashboards = {}
+        self.changesets = {}
+        self.deployments = {}
+        self.n_roles = max(1, n_stacks // STACKS_FOR_ROLE)
+
+        for i in range(n_stacks):
+            self._add_stack(i)
+        self.ssm[f"{cfg.SSM_BASE_PATH}/regions"] = region
+
+    def _arn(self, service, resource):
+        return f"arn:aws:{service}:{self.region}:{ACCOUNT_ID}:{resource}"
+
+    def _get_template(self, name, role, stack_type, base):
+        resources = {
+            "LogGroup": {"Type": "AWS::Logs::LogGroup", "Properties": {}},
+            "Topic": {
+                "Type": "AWS::SNS::Topic",
+                "Properties": {"TopicName": {"Fn::ImportValue": f"{base}-Topic"}},
+            },
+        }
+        if "ecs" in stack_type.split():
+            resources["TaskDefinition"] = {
+                "Type": "AWS::ECS::TaskDefinition",
+                "Properties": {
+                    "ContainerDefinitions": [
+                        {"Name": role, "Image": "nginx:latest"},
+                    ],
+                },
+            }
+            resources["Service"] = {
+                "Type": "AWS::ECS::Service",
+                "Properties": {"TaskDefinition": {"Ref": "TaskDefinition"}},
+            }
+
+        parameters = {
+            n: {"Type": "String", "Default": "", "Description": f"{n} parameter"}
+            for n in ["Env", "EnvRole", "EnvShort", "EnvApp1Version"]
+        }
+        parameters["DesiredCapacity"] = {
+            "Type": "String",
+            "Default": "1",
+            "Description": "Desired Capacity",
+        }
+
+        return {
+            "AWSTemplateFormatVersion": "2010-09-09",
+            "Parameters": parameters,
+            "Conditions": {},
+            "Mappings": {},
+            "Resources": resources,
+            "Outputs": {
+                "EnvRole": {"Value": role},
+                "StackType": {"Value": stack_type},
+                "Topic": {
+                    "Value": {"Ref": "Topic"},
+                    "Export": {"Name": {"Fn::Sub": "${AWS::StackName}-Topic"}},
+                },
+            },
+        }
+
+    def _add_stack(self, i):
+        env = ENVS[i % len(ENVS)]
+        role = f"role-{i % self.n_roles}"
+        stack_type = "ecs app" if i % 2 else "app"
+        name = f"{env}-{role}-{i}"
+        base = next(iter(self.stacks), name)
+        stack_id = self._arn("cloudformation", f"stack/{name}/{i:08d}")
+        created = _now() - timedelta(days=30, seconds=i)
+
+        template = self._get_template(name, role, stack_type, base)
+        self.templates[name] = template
+        self.resources[name] = [
+            {
+                "LogicalResourceId": r,
+                "PhysicalResourceId": self._get_physical_id(name, r, v["Type"], 1),
+                "ResourceType": v["Type"],
+                "ResourceStatus": "CREATE_COMPLETE",
+                "LastUpdatedTimestamp": created,
+            }
+            for r, v in template["Resources"].items()
+        ]
+        self.exports[f"{name}-Topic"] = {
+            "Name": f"{name}-Topic",
+            "Value": self._arn("sns", f"{name}-topic"),
+            "ExportingStackId": stack_id,
+        }
+        self.stacks[name] = {
+            "StackId": stack_id,
+            "StackName": name,
+            "CreationTime": created,
+            "StackStatus": "CREATE_COMPLETE",
+            "Parameters": [
+                {"ParameterKey": "Env", "ParameterValue": env},
+                {"ParameterKey": "EnvRole", "ParameterValue": role},
+                {"ParameterKey": "EnvShort", "ParameterValue": env},
+                {"ParameterKey": "EnvApp1Version", "ParameterValue": "1"},
+                {"ParameterKey": "DesiredCapacity", "ParameterValue": "1"},
+            ],
+            "Outputs": [
+                {"OutputKey": "EnvRole", "OutputValue": role},
+                {"OutputKey": "StackType", "OutputValue": stack_type},
+                {
+                    "OutputKey": "Topic",
+                    "OutputValue": self.exports[f"{name}-Topic"]["Value"],
+                    "ExportName": f"{name}-Topic",
+                },
+            ],
+            "Tags": [
+                {"Key": "Env", "Value": env},
+                {"Key": "EnvRole", "Value": role},
+            ],
+        }
+        self.events[name] = [
+            self._get_event(name, name, "AWS::CloudFormation::Stack", status, created)
+            for status in ["CREATE_IN_PROGRESS", "CREATE_COMPLETE"]
+        ]
+        self.pending_events[name] = []
+
+    def _get_physical_id(self, name, logical_id, res_type, revision):
+        if res_type == "AWS::ECS::Service":
+            cluster = f"cluster-{name.split('-')[0]}"
+            return self._arn("ecs", f"service/{cluster}/{name}-{logical_id}")
+        if res_type == "AWS::ECS::TaskDefinition":
+            return self._arn("ecs", f"task-definition/{name}:{revision}")
+
+        return f"{name}-{logical_id}"
+
+    def _get_event(self, name, logical_id, res_type, status, timestamp, pid=None):
+        return {
+            "StackId": self.stacks[name]["StackId"] if name in self.stacks else name,
+            "EventId": f"{logical_id}-{status}-{timestamp.timestamp()}",
+            "StackName": name,
+            "LogicalResourceId": logical_id,
+            "PhysicalResourceId": pid if pid else name,
+            "ResourceType": res_type,
+            "Timestamp": timestamp,
+            "ResourceStatus": status,
+        }
+
+    def _get_stack(self, name):
+        stack = self.stacks.get(name.split("/")[1] if "/" in name else name)
+        if not stack:
+            raise simulated_error(
+                "ValidationError", f"Stack with id {name} does not exist"
+            )
+        self._advance(stack["StackName"])
+
+        return stack
+
+    # move events due by now to the stack (simulated update timing)
+    def _advance(self, name):
+        now = _now()
+        pending = self.pending_events[name]
+        while pending and pending[0]["Timestamp"] <= now:
+            event = pending.pop(0)
+            self.events[name].append(event)
+            if event["ResourceType"] == "AWS::CloudFormation::Stack":
+                self.stacks[name]["StackStatus"] = event["ResourceStatus"]
+
+    def _schedule_update(self, name):
+        stack = self.stacks[name]
+        start = _now()
+        duration = _scaled(self.random.uniform(*cfg.SIMULATOR_UPDATE_TIME))
+        stack["StackStatus"] = "UPDATE_IN_PROGRESS"
+        stack["LastUpdatedTime"] = start
+        stack_type = "AWS::CloudFormation::Stack"
+        events = [self._get_event(name, name, stack_type, "UPDATE_IN_PROGRESS", start)]
+        resources = self.resources[name]
+        step = timedelta(seconds=duration / (len(resources) + 2))
+        for n, r in enumerate(resources):
+            at = start + step * (n + 1)
+            done_at = at
+            if r["ResourceType"] == "AWS::ECS::TaskDefinition":
+                old_task_definition = r["PhysicalResourceId"]
+                revision = int(r["PhysicalResourceId"].split(":")[-1]) + 1
+                r["PhysicalResourceId"] = self._get_physical_id(
+                    name, r["LogicalResourceId"], r["ResourceType"], revision
+                )
+            if r["ResourceType"] == "AWS::ECS::Service":
+                # service deployment last until next resource
+                done_at = at + step
+                self.deployments[name] = {
+                    "old": old_task_definition,
+                    "start": at,
+                    "end": done_at,
+                }
+            for status, status_at in [
+                ("UPDATE_IN_PROGRESS", at),
+                ("UPDATE_COMPLETE", done_at),
+            ]:
+                events.append(
+                    self._get_event(
+                        name,
+                        r["LogicalResourceId"],
+                        r["ResourceType"],
+                        status,
+                        status_at,
+                        r["PhysicalResourceId"],
+                    )
+                )
+        events.sort(key=lambda x: x["Timestamp"])
+        end = start + timedelta(seconds=duration)
+        for status in ["UPDATE_COMPLETE_CLEANUP_IN_PROGRESS", "UPDATE_COMPLETE"]:
+            events.append(self._get_event(name, name, stack_type, status, end))
+        self.pending_events[name] = events
+        self._advance(name)
+
+    # CloudFormation
+
+    def cloudformation_ListStacks(self, params):
+        status = params.get("StackStatusFilter")
+        summaries = []
+        for name in self.stacks:
+            stack = self._get_stack(name)
+            if status and stack["StackStatus"] not in status:
+                continue
+            summaries.append(
+                {
+                    k: stack[k]
+                    for k in [
+                        "StackId",
+                        "StackName",
+                        "CreationTime",
+                        "LastUpdatedTime",
+                        "StackStatus",
+                    ]
+                    if k in stack
+                }
+            )
+
+        return _paginate(summaries, params, "StackSummaries")
+
+    def cloudformation_DescribeStacks(self, params):
+        if "StackName" in params:
+            return {"Stacks": [self._get_stack(params["StackName"])]}
+
+        response = _paginate(list(self.stacks), params, "Stacks")
+        response["Stacks"] = [self._get_stack(n) for n in response["Stacks"]]
+
+        return response
+
+    def cloudformation_GetTemplate(self, params):
+        stack = self._get_stack(params["StackName"])
+
+        return {"TemplateBody": json.dumps(self.templates[stack["StackName"]])}
+
+    def cloudformation_ListExports(self, params):
+        return _paginate(list(self.exports.values()), params, "Exports")
+
+    def cloudformation_ListStackResources(self, params):
+        stack = self._get_stack(params["StackName"])
+
+        return _paginate(
+            self.resources[stack["StackName"]], params, "StackResourceSummaries"
+        )
+
+    def cloudformation_DescribeStackEvents(self, params):
+        stack = self._get_stack(params["StackName"])
+
+        return _paginate(self.events[stack["StackName"]][::-1], params, "StackEvents")
+
+    def cloudformation_UpdateStack(self, params):
+        stack = self._get_stack(params["StackName"])
+        if stack["StackStatus"] not in cfg.STACK_COMPLETE_STATUS:
+            raise simulated_error(
+                "ValidationError",
+                f"Stack:{stack['StackId']} is in {stack['StackStatus']} state "
+                "and can not be updated.",
+            )
+        stack["Parameters"] = [
+            (
+                p
+                if "ParameterValue" in p
+                else {
+                    "ParameterKey": p["ParameterKey"],
+                    "ParameterValue": next(
+                        o["ParameterValue"]
+                        for o in stack["Parameters"]
+                        if o["ParameterKey"] == p["ParameterKey"]
+                    ),
+                }
+            )
+            for p in params.get("Parameters", [])
+        ] or stack["Parameters"]
+        self._schedule_update(stack["StackName"])
+
+        return {"StackId": stack["StackId"]}
+
+    def cloudformation_CreateChangeSet(self, params):
+        stack = self._get_stack(params["StackName"])
+        changeset_id = self._arn(
+            "cloudformation",
+            f"changeSet/{params['ChangeSetName']}/{len(self.changesets)}",
+        )
+        self.changesets[changeset_id] = {
+            "ChangeSetId": changeset_id,
+            "ChangeSetName": params["ChangeSetName"],
+            "StackId": stack["StackId"],
+            "StackName": stack["StackName"],
+            "Status": "CREATE_COMPLETE",
+            "ExecutionStatus": "AVAILABLE",
+            "Parameters": params.get("Parameters", []),
+            "Changes": [],
+        }
+
+        return {"Id": changeset_id, "StackId": stack["StackId"]}
+
+    def cloudformation_DescribeChangeSet(self, params):
+        changeset = self.changesets.get(params["ChangeSetName"])
+        if not changeset:
+            raise simulated_error(
+                "ChangeSetNotFound", f"ChangeSet {params['ChangeSetName']} not found"
+            )
+
+        return changeset
+
+    def cloudformation_DeleteChangeSet(self, params):
+        self.changesets.pop(params["ChangeSetName"], None)
+
+        return {}
+
+    def cloudformation_ExecuteChangeSet(self, params):
+        changeset = self.changesets.pop(params["ChangeSetName"])
+        self._schedule_update(changeset["StackName"])
+
+        return {}
+
+    # STS
+
+    def sts_GetCallerIdentity(self, params):
+        return {
+            "Account": ACCOUNT_ID,
+            "UserId": "SIMULATOR",
+            "Arn": f"arn:aws:iam::{ACCOUNT_ID}:user/simulator",
+        }
+
+    # ECS
+
+    def ecs_DescribeServices(self, params):
+        services = []
+        for s in params["services"]:
+            name = s.split("/")[-1].rsplit("-", 1)[0]
+            task_definition = next(
+                r["PhysicalResourceId"]
+                for r in self.resources[name]
+                if r["ResourceType"] == "AWS::ECS::TaskDefinition"
+            )
+            deployment = self.deployments.get(name)
+            in_progress = deployment and deployment["end"] > _now()
+            deployments = [
+                {
+                    "status": "PRIMARY",
+                    "taskDefinition": task_definition,
+                    "desiredCount": 1,
+                    "runningCount": 0 if in_progress else 1,
+                    "pendingCount": 1 if in_progress else 0,
+                    "failedTasks": 0,
+                    "rolloutState": "IN_PROGRESS" if in_progress else "COMPLETED",
+                    "updatedAt": deployment["start"] if deployment else _now(),
+                }
+            ]
+            if in_progress:
+                deployments.append(
+                    {
+                        "status": "ACTIVE",
+                        "taskDefinition": deployment["old"],
+                        "desiredCount": 1,
+                        "runningCount": 1,
+                        "pendingCount": 0,
+                        "failedTasks": 0,
+                        "rolloutState": "COMPLETED",
+                        "updatedAt": deployment["start"],
+                    }
+                )
+            services.append({"serviceName": s, "deployments": deployments})
+
+        return {"services": services, "failures": []}
+
+    # SSM
+
+    def ssm_PutParameter(self, params):
+        self.ssm[params["Name"]] = params["Value"]
+
+        return {"Version": 1}
+
+    def ssm_GetParameter(self, params):
+        if params["Name"] not in self.ssm:
+            raise simulated_error("ParameterNotFound", params["Name"])
+
+        return {
+            "Parameter": {"Name": params["Name"], "Value": self.ssm[params["Name"]]}
+        }
+
+    def ssm_GetParametersByPath(self, params):
+        path = params["Path"].rstrip("/") + "/"
+        parameters = [
+            {"Name": n, "Value": v} for n, v in self.ssm.items() if n.startswith(path)
+        ]
+
+        return _paginate(parameters, params, "Parameters")
+
+    # CloudWatch
+
+    def cloudwatch_ListDashboards(self, params):
+        prefix = params.get("DashboardNamePrefix", "")
+        entries = [
+            {"DashboardName": n, "DashboardArn": self._arn("cloudwatch", n)}
+            for n in self.dashboards
+            if n.startswith(prefix)
+        ]
+
+        return _paginate(entries, params, "DashboardEntries")
+
+    def cloudwatch_GetDashboard(self, params):
+        name = params["DashboardName"]
+        if name not in self.dashboards:
+            raise simulated_error("ResourceNotFound", f"Dashboard {name} not found")
+
+        return {"DashboardName": name, "DashboardBody": self.dashboards[name]}
+
+    def cloudwatch_PutDashboard(self, params):
+        self.dashboards[params["DashboardName"]] = params["DashboardBody"]
+
+        return {"DashboardValidationMessages": []}
+
+    def cloudwatch_DeleteDashboards(self, params):
+        for n in params["DashboardNames"]:
+            self.dashboards.pop(n, None)
+
+        return {}
+
+    # Route53
+
+    def route53_ListHostedZonesByName(self, params):
+        return {"HostedZones": []}
+
+    def call(self, service, operation, params):
+        handler = getattr(self, f"{service}_{operation}", None)
+        if not handler:
+            stats["unhandled"] += 1
+            logger.debug(f"Simulator: {service} {operation} not simulated")
+            return {}
+
+        # responses are copies, backend state change while callers use them
+        with _lock:
+            return copy.deepcopy(handler(params))
+
+
+def _get_account(region):
+    global _account
+
+    with _lock:
+        if _account is None:
+            start = time.time()
+            _account = account(cfg.simulate, region)
+            logger.info(
+                f"Simulating {cfg.simulate} stacks "
+                f"[seeded in {time.time() - start:.2f}s]"
+            )
+
+    return _account
+
+
+# number of throttled attempts for a call, botocore retries them with
+# exponential backoff and give up after MAX_ATTEMPTS
+def _get_throttles():
+    throttles = 0
+    while throttles < MAX_ATTEMPTS and random.random() < cfg.simulate_throttle:
+        throttles += 1
+        if throttles < MAX_ATTEMPTS:
+            time.sleep(_scaled(BACKOFF_TIME * 2**throttles))
+
+    return throttles
+
+
+# hook the simulated account into client calls using botocore events
+def register(client):
+    if not cfg.simulate:
+        return
+
+    region = client.meta.region_name
+    service = client.meta.service_model.service_name
+    service_id = client.meta.service_model.service_id.hyphenize()
+    events = client.meta.events
+    params_key = "ibox_simulator_params"
+
+    def before_parameter_build(params, context, **kwargs):
+        context[params_key] = params
+
+    def before_call(model, context, **kwargs):
+        if cfg.SIMULATOR_LATENCY:
+            time.sleep(_scaled(cfg.SIMULATOR_LATENCY))
+
+        throttles = _get_throttles()
+        with _lock:
+            stats["calls"] += 1
+            stats["throttles"] += throttles
+        context[THROTTLES_CONTEXT_KEY] = throttles
+        if throttles == MAX_ATTEMPTS:
+            code, message, status = "Throttling", "Rate exceeded", 400
+        else:
+            try:
+                parsed = _get_account(region).call(
+                    service, model.name, context.get(params_key, {})
+                )
+                status = 200
+            except simulated_error as e:
+                code, message, status = e.code, str(e), e.status
+
+        if status != 200:
+            parsed = {"Error": {"Code": code, "Message": message}}
+        parsed["ResponseMetadata"] = {"HTTPStatusCode": status, "RetryAttempts": 0}
+
+        return AWSResponse(None, status, {}, None), parsed
+
+    events.register(f"before-parameter-build.{service_id}", before_parameter_build)
+    events.register_last(f"before-call.{service_id}", before_call)
+
+
+def log_stats():
+    if not cfg.simulate:
+        return
+
+    logger.info(
+        f"Simulator: {stats['calls']} calls, {stats['throttles']} throttled "
+        f"attempts, {stats['unhandled']} not simulated"
+    )
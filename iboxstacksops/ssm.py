@@ -1,5 +1,3 @@
-from prettytable import PrettyTable
-
 from . import cfg, i_stack
 from .aws import myboto3
 from .tools import concurrent_exec
@@ -100,6 +98,8 @@ def put(iregion):
 
 
 def show(data):
+    from prettytable import PrettyTable
+
     params_map = {}
     params_keys = []
     table = PrettyTable()
@@ -1,4 +1,8 @@
-from . import logger, cfg, parameters, outputs
+import concurrent.futures
+from fnmatch import fnmatchcase
+from botocore.exceptions import ClientError
+
+from . import logger, cfg, parameters, outputs, cache
 from .aws import myboto3
 
 
@@ -39,44 +43,262 @@ def get_base_data(stack, stackset=None):
     return data
 
 
-def _get_stack(r, data):
-    for s in r["Stacks"]:
-        stack_name = s["StackName"]
-        stack_data = get_base_data(s)
-        stack_role = stack_data.get("EnvRole", None)
-        stack_type = stack_data.get("StackType", None)
-        if (
-            stack_name in cfg.stack
-            or stack_role in cfg.role
-            or stack_type in cfg.type
-            or any(t in cfg.type for t in (stack_type.split() if stack_type else []))
-            or (
-                len(cfg.type) == 1
-                and cfg.type[0].endswith("+")
-                and cfg.type[0].rstrip("+") == stack_type
-            )
-            or "ALL" in cfg.type
-        ):
-            data[stack_name] = stack_data
+# get a stack value without building the full base data,
+# looking at outputs first and then at parameters like get_base_data do
+def _get_stack_value(stack, key):
+    for o in stack.get("Outputs", []):
+        if o["OutputKey"] == key:
+            return o.get("OutputValue")
+
+    for p in stack.get("Parameters", []):
+        if p["ParameterKey"] == key:
+            return p.get("ParameterValue")
+
+
+def _has_glob(names):
+    return any(c in n for n in names for c in "*?[")
+
+
+def _match_names(stack_name, names):
+    return any(fnmatchcase(stack_name, n) for n in names)
+
+
+# stack keys for the inverted index used for selection
+def _get_index_keys(stack):
+    keys = set()
+    stack_role = _get_stack_value(stack, "EnvRole")
+    stack_type = _get_stack_value(stack, "StackType")
+    stack_env = _get_stack_value(stack, "Env")
+
+    if stack_role is not None:
+        keys.add(f"EnvRole={stack_role}")
+    if stack_type is not None:
+        keys.add(f"StackType={stack_type}")
+        keys.update(f"StackTypeToken={t}" for t in stack_type.split())
+    if stack_env is not None:
+        keys.add(f"Env={stack_env}")
+    for t in stack.get("Tags", []):
+        keys.add(f"Tag:{t['Key']}={t['Value']}")
+
+    return keys
+
+
+def _add_to_index(index, name, keys):
+    for k in keys:
+        index.setdefault(k, set()).add(name)
+
+
+def _remove_from_index(index, name, keys):
+    for k in keys:
+        names = index.get(k)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del index[k]
+
+
+# index keys (patterns) to look for, based on role/type selection args
+def _get_selectors():
+    selectors = [f"EnvRole={r}" for r in cfg.role]
+    for t in cfg.type:
+        selectors.append(f"StackType={t}")
+        selectors.append(f"StackTypeToken={t}")
+    if len(cfg.type) == 1 and cfg.type[0].endswith("+"):
+        selectors.append(f"StackType={cfg.type[0].rstrip('+')}")
+
+    return selectors
+
+
+# index keys (patterns) of env/tag filters, a stack must match one key
+# for every filter: any of the envs and every tag
+def _get_filters():
+    filters = []
+    if cfg.env:
+        filters.append([f"Env={e}" for e in cfg.env])
+    filters.extend([f"Tag:{t}"] for t in cfg.tag)
+
+    return filters
+
+
+def _get_matching(index, selector):
+    if not _has_glob([selector]):
+        return set(index.get(selector, []))
+
+    matching = set()
+    for key, key_names in index.items():
+        if fnmatchcase(key, selector):
+            matching.update(key_names)
+
+    return matching
+
+
+# return selected stacks names, using set operations on the inverted index:
+# union of stack names and role/type selections (all stacks if none),
+# intersected with env/tag filters
+def _select(index, names):
+    if "ALL" in cfg.type or not (cfg.stack or cfg.role or cfg.type):
+        selected = set(names)
+    elif _has_glob(cfg.stack):
+        selected = {n for n in names if _match_names(n, cfg.stack)}
+    else:
+        selected = set(cfg.stack).intersection(names)
+
+    if "ALL" not in cfg.type:
+        for selector in _get_selectors():
+            selected.update(_get_matching(index, selector))
+
+    for selectors in _get_filters():
+        matching = set()
+        for selector in selectors:
+            matching.update(_get_matching(index, selector))
+        selected &= matching
+
+    return selected
+
+
+def _is_selected(stack_name, stack):
+    index = {}
+    _add_to_index(index, stack_name, _get_index_keys(stack))
+
+    return stack_name in _select(index, [stack_name])
+
+
+def has_selectors():
+    return bool(cfg.role or cfg.type or cfg.tag or cfg.env)
 
 
 def _get_stackset(r, data):
     s = r["StackSet"]
     stack_name = s["StackSetName"]
-    stack_data = get_base_data(s, stackset=True)
-    stack_role = stack_data.get("EnvRole", None)
-    stack_type = stack_data.get("StackType", None)
-    if (
-        stack_name in cfg.stack
-        or stack_role in cfg.role
-        or stack_type in cfg.type
-        or any(t in cfg.type for t in (stack_type.split() if stack_type else []))
-        or "ALL" in cfg.type
-    ):
-        data[stack_name] = stack_data
+    if _is_selected(stack_name, s):
+        data[stack_name] = get_base_data(s, stackset=True)
 
 
-def get(names=[], exit_if_empty=True, obj=None, stackset=None):
+# cheap listing of live stacks, used to find out the changed ones
+def list_stacks(client):
+    summaries = {}
+    paginator = client.get_paginator("list_stacks")
+    response_iterator = paginator.paginate(StackStatusFilter=cfg.STACK_LIVE_STATUS)
+    for r in response_iterator:
+        for s in r["StackSummaries"]:
+            summaries[s["StackName"]] = s
+
+    return summaries
+
+
+def _describe_stack(client, name, missing_ok=False):
+    try:
+        response = client.describe_stacks(StackName=name)
+    except ClientError:
+        if missing_ok:
+            # stack deleted after listing
+            return
+        raise
+
+    return response["Stacks"][0]
+
+
+# yield stacks descriptions, few stacks are described serially, the others
+# are sharded over a bounded pool and yielded as soon as they arrive
+def _describe_stacks(client, names, missing_ok=False):
+    if len(names) <= cfg.DISCOVERY_SERIAL_MAX_STACKS:
+        for n in names:
+            stack = _describe_stack(client, n, missing_ok)
+            if stack:
+                yield stack
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=cfg.DISCOVERY_JOBS
+    ) as executor:
+        futures = [
+            executor.submit(_describe_stack, client, n, missing_ok) for n in names
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            stack = future.result()
+            if stack:
+                yield stack
+
+
+# yield all stacks descriptions page by page
+def _describe_all_stacks(client):
+    paginator = client.get_paginator("describe_stacks")
+    response_iterator = paginator.paginate()
+    for r in response_iterator:
+        yield from r["Stacks"]
+
+
+def _stack_signature(stack):
+    return (
+        stack["StackId"],
+        stack["StackStatus"],
+        stack.get("LastUpdatedTime"),
+    )
+
+
+# yield selected stacks descriptions reading through the local discovery
+# cache and its inverted index, only stacks changed since last run
+# (and matching names, if any) are described again, all of them page by
+# page if they are more than STACKS_CACHE_MAX_CHANGED
+def _get_selected(client, boto3, names=[]):
+    path = cache.get_path("stacks", boto3)
+    cached = None if cfg.refresh else cache.load(path)
+
+    if cached and "index" in cached:
+        cached_stacks = cached["stacks"]
+        index = {k: set(v) for k, v in cached["index"].items()}
+    else:
+        cached = None
+        cached_stacks = {}
+        index = {}
+
+    if cache.is_fresh(cached, cfg.max_age):
+        logger.debug(f"Using stacks cache {path}")
+        for n in _select(index, cached_stacks):
+            yield cached_stacks[n]
+        return
+
+    descriptions = {}
+    changed = []
+    for name, summary in list_stacks(client).items():
+        stack = cached_stacks.get(name)
+        if stack and _stack_signature(stack) == _stack_signature(summary):
+            descriptions[name] = stack
+        elif not names or _match_names(name, names):
+            changed.append(name)
+
+    logger.debug(f"Stacks cache: {len(descriptions)} unchanged {len(changed)} changed")
+    if len(changed) > cfg.STACKS_CACHE_MAX_CHANGED:
+        descriptions = {}
+        changed_descriptions = _describe_all_stacks(client)
+    else:
+        changed_descriptions = _describe_stacks(client, changed, missing_ok=True)
+
+    # drop changed and deleted stacks from index
+    for name, stack in cached_stacks.items():
+        if name not in descriptions:
+            _remove_from_index(index, name, _get_index_keys(stack))
+
+    for n in _select(index, descriptions):
+        yield descriptions[n]
+
+    for s in changed_descriptions:
+        name = s["StackName"]
+        descriptions[name] = s
+        _add_to_index(index, name, _get_index_keys(s))
+        if _is_selected(name, s):
+            yield s
+
+    cache.save(
+        path,
+        {
+            "stacks": descriptions,
+            "index": {k: sorted(v) for k, v in index.items()},
+        },
+    )
+
+
+def _get_client(obj):
     if not obj:
         boto3 = myboto3()
         client = boto3.client("cloudformation")
@@ -84,27 +306,50 @@ def get(names=[], exit_if_empty=True, obj=None, stackset=None):
         boto3 = getattr(obj, "boto3")
         client = boto3.client("cloudformation")
 
+    return boto3, client
+
+
+# streaming discovery - yield (name, base data) for selected stacks
+# as soon as they are found, without waiting for the whole listing
+def get_iter(names=[], obj=None, warn_if_empty=True):
+    boto3, client = _get_client(obj)
+
     logger.info("Getting Stacks Description")
-    data = {}
+    found = False
 
     if not names:
         names = cfg.stack
 
+    if has_selectors():
+        descriptions = _get_selected(client, boto3)
+    elif _has_glob(names) or len(names) > cfg.STACKS_CACHE_MAX_CHANGED:
+        # list stacks and describe only the ones matching names
+        descriptions = _get_selected(client, boto3, names)
+    else:
+        descriptions = _describe_stacks(client, names)
+
+    for s in descriptions:
+        found = True
+        yield s["StackName"], get_base_data(s)
+
+    if not found and warn_if_empty:
+        logger.warning("No Stacks found!\n")
+
+
+def get(names=[], exit_if_empty=True, obj=None, stackset=None):
     if stackset:
+        boto3, client = _get_client(obj)
+
+        logger.info("Getting Stacks Description")
+        data = {}
         response = client.describe_stack_set(StackSetName=cfg.stack[0])
         _get_stackset(response, data)
-    elif not cfg.role and not cfg.type and len(names) < cfg.MAX_SINGLE_STACKS:
-        for s in names:
-            response = client.describe_stacks(StackName=s)
-            _get_stack(response, data)
+        if not data and exit_if_empty:
+            logger.warning("No Stacks found!\n")
     else:
-        paginator = client.get_paginator("describe_stacks")
-        response_iterator = paginator.paginate()
-        for r in response_iterator:
-            _get_stack(r, data)
+        data = dict(get_iter(names, obj, warn_if_empty=exit_if_empty))
 
     if not data and exit_if_empty:
-        logger.warning("No Stacks found!\n")
         exit(0)
 
     return data
@@ -1,9 +1,9 @@
-from prettytable import PrettyTable
-
 from . import cfg
 
 
 def get(data, fields=[]):
+    from prettytable import PrettyTable
+
     table_data_names = {}
 
     for f in fields if fields else cfg.fields:
@@ -1,6 +1,4 @@
 import json
-import yaml
-from collections import OrderedDict
 
 from . import logger, IboxError
 
@@ -26,6 +24,8 @@ def _update_template_param(istack):
 
 
 def get_template(istack, stackset=None):
+    import yaml
+
     logger.info("Getting Template Body")
     # update template param if using version one
     if istack.cfg.version:
@@ -56,7 +56,7 @@ def get_template(istack, stackset=None):
             else:
                 response = istack.client.get_template(StackName=istack.name)
                 tbody = response["TemplateBody"]
-            if isinstance(tbody, OrderedDict):
+            if isinstance(tbody, dict):
                 body = json.dumps(tbody)
             else:
                 body = tbody
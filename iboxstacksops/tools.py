@@ -1,11 +1,26 @@
 import time
 import sys
+import math
+import random
+import threading
+import contextvars
 import concurrent.futures
+from functools import partial
 from pprint import pformat
 from traceback import print_exc
 
-from . import logger, tqdm, cfg, IboxError
-from .aws import myboto3
+from . import logger, cfg, trace, IboxError
+
+# worker budget shared by (nested) concurrent_exec calls,
+# a global semaphore sized by jobs and optional per region ones.
+# It bounds running jobs; pool threads are started only for jobs that
+# got their slots, but each nested call has its own pool, so idle threads
+# are not shared between pools
+_budget = {}
+_budget_lock = threading.Lock()
+_local = threading.local()
+# asyncio engine, stack processed by the current task
+_async_job = contextvars.ContextVar("async_job", default=None)
 
 
 def show_confirm():
@@ -22,6 +37,70 @@ def show_confirm():
         return True
 
 
+# sleep scaled by time_scale (0 do not wait, ex. replaying a cassette)
+def sleep(seconds):
+    if cfg.time_scale:
+        with trace.span("tools.sleep", seconds=seconds):
+            time.sleep(seconds * cfg.time_scale)
+
+
+# asyncio engine sleep, scaled as sleep
+async def async_sleep(seconds):
+    import asyncio
+
+    if cfg.time_scale:
+        await asyncio.sleep(seconds * cfg.time_scale)
+
+
+def _run_as_job(job, func, args, kwargs):
+    parent_job = getattr(_local, "job", None)
+    _local.job = job
+
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _local.job = parent_job
+
+
+# asyncio engine, run a blocking call (aws api, output, input) in the
+# loop executor (bounded to ASYNC_ENGINE_MAX_WORKERS threads) as part
+# of the current task stack job
+async def run_sync(func, *args, **kwargs):
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(
+        None, _run_as_job, _async_job.get(), func, args, kwargs
+    )
+
+
+# Waiters polling interval. Adaptive policy start at floor after an action,
+# back off (POLL_BACKOFF) while nothing changes up to ceiling and snap back
+# to floor when something changed, fixed policy always wait interval.
+# Both are jittered to not poll in lockstep.
+class poll_policy(object):
+    def __init__(self, interval):
+        self.adaptive = cfg.poll_policy == "adaptive"
+        self.floor = cfg.poll_floor if self.adaptive else interval
+        self.ceiling = max(self.floor, cfg.poll_ceiling)
+        self.interval = self.floor
+
+    def next(self, changed=False):
+        if changed or not self.adaptive:
+            self.interval = self.floor
+        else:
+            self.interval = min(self.ceiling, self.interval * cfg.POLL_BACKOFF)
+
+        return self.interval * random.uniform(1 - cfg.poll_jitter, 1 + cfg.poll_jitter)
+
+    def sleep(self, changed=False):
+        sleep(self.next(changed))
+
+    async def async_sleep(self, changed=False):
+        await async_sleep(self.next(changed))
+
+
 def _pause_or_stop():
     if cfg.pause == 0:
         if not show_confirm():
@@ -30,53 +109,394 @@ def _pause_or_stop():
         time.sleep(cfg.pause)
 
 
-def concurrent_exec(command, stacks, smodule, region=None, **kwargs):
-    n_failed = 0
-    do_exit = False
-    data = {}
-    func = getattr(smodule, "exec_command")
+def _get_semaphores(region):
+    semaphores = []
+    with _budget_lock:
+        if region and cfg.region_jobs:
+            if region not in _budget:
+                _budget[region] = threading.BoundedSemaphore(cfg.region_jobs)
+            semaphores.append(_budget[region])
+        if cfg.jobs:
+            if None not in _budget:
+                _budget[None] = threading.BoundedSemaphore(cfg.jobs)
+            semaphores.append(_budget[None])
 
-    jobs = cfg.jobs if cfg.jobs else len(stacks)
-    if jobs == 0:
-        return
+    return semaphores
+
+
+def _acquire_slots(region):
+    semaphores = _get_semaphores(region)
+    with trace.span("tools.wait_job_slot"):
+        for s in semaphores:
+            s.acquire()
+
+    return semaphores
+
+
+# run a job holding its slots of the worker budget, taken here
+# or already by the caller (semaphores)
+def _run_job(func, name, data, command, region, kwargs, semaphores=None):
+    parent_job = getattr(_local, "job", None)
+    _local.job = name
+    if semaphores is None:
+        semaphores = _acquire_slots(region)
+    _local.semaphores = semaphores
+
+    try:
+        return func(name, data, command, region, **kwargs)
+    finally:
+        _local.job = parent_job
+        _local.semaphores = []
+        for s in reversed(semaphores):
+            s.release()
 
-    cfg.parallel = False if not cfg.parallel and jobs == 1 else True
-    use_pbar = True if len(stacks) > 1 else False
+
+# name of the stack (or region) processed by the current job, if any
+def get_current_job():
+    return getattr(_local, "job", None)
+
+
+# store stack result in data, return True if stack failed
+def _set_result(data, stack, get_result):
+    try:
+        data[stack] = get_result()
+    except IboxError as e:
+        data[stack] = e.args[0]
+        return True
+    except Exception as e:
+        print(f"{stack} generated an exception: {e}")
+        print_exc()
+        raise IboxError(e)
+
+
+def _thread_exec(func, stacks, command, region, kwargs, jobs, pbar, collect):
+    do_exit = False
 
     with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
         future_to_stack = {}
-        for s, v in stacks.items():
-            ex_sub = executor.submit(func, s, v, command, region, **kwargs)
+        next_stack = next(stacks, None)
+        while next_stack is not None:
+            s, v = next_stack
+            # take the job slots before submitting, so that pool threads
+            # are created only for jobs that can run
+            semaphores = _acquire_slots(region)
+            ex_sub = executor.submit(
+                _run_job, func, s, v, command, region, kwargs, semaphores
+            )
 
             future_to_stack[ex_sub] = s
+            next_stack = next(stacks, None)
 
-            if not cfg.parallel and list(stacks)[-1] != s:
+            if not cfg.parallel and next_stack is not None:
                 concurrent.futures.wait({ex_sub: s})
                 if _pause_or_stop():
                     do_exit = True
                     break
-        pbar = tqdm(
-            concurrent.futures.as_completed(future_to_stack),
-            total=len(future_to_stack),
-            desc="Processing Stacks",
-            disable=False if use_pbar else True,
+
+        # discovery ended, now total is known
+        pbar.total = len(future_to_stack)
+        pbar.refresh()
+
+        for future in concurrent.futures.as_completed(future_to_stack):
+            collect(future_to_stack[future], future.result)
+
+    return do_exit
+
+
+# asyncio engine, stacks are tasks awaiting their (async) command,
+# bounded by jobs, waiting without holding a thread.
+# Blocking calls run in the loop executor, shared by all the stacks
+async def _async_exec(func, stacks, command, region, kwargs, jobs, pbar, collect):
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(jobs, cfg.ASYNC_ENGINE_MAX_WORKERS),
+            thread_name_prefix="async-engine",
         )
+    )
+    slots = asyncio.Semaphore(jobs)
+
+    async def run_job(name, data):
+        async with slots:
+            _async_job.set(name)
+            return await func(name, data, command, region, **kwargs)
+
+    task_to_stack = {}
+    while True:
+        # stacks can be a discovery in progress
+        next_stack = await loop.run_in_executor(None, next, stacks, None)
+        if next_stack is None:
+            break
+        s, v = next_stack
+        task_to_stack[asyncio.create_task(run_job(s, v))] = s
+
+    # discovery ended, now total is known
+    pbar.total = len(task_to_stack)
+    pbar.refresh()
+
+    pending = set(task_to_stack)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            collect(task_to_stack[task], task.result)
+
 
-        for future in pbar:
-            stack = future_to_stack[future]
-            try:
-                data[stack] = future.result()
-            except IboxError as e:
-                data[stack] = e.args[0]
+def _get_future_result(future, failed):
+    return future.exception().args[0] if failed else future.result()
+
+
+# value can be a number of stacks or a percentage of total (ex. 10%)
+def _get_count(value, total):
+    value = str(value)
+    if value.endswith("%"):
+        return math.ceil(total * float(value[:-1]) / 100)
+
+    return int(value)
+
+
+def _not_started():
+    return "Not started, rollout halted"
+
+
+# wave (canary) execution, waves are the cumulative number of stacks
+# to process at the end of each wave (ex. 1 10% 50%, then the rest),
+# a wave start when the previous one ended and on_done
+# (called with name, result, failed) returned True for its stacks.
+# If more than max_failures stacks did not, scheduling is halted and
+# untouched stacks are returned as not started
+def _wave_exec(
+    func,
+    stacks,
+    command,
+    region,
+    kwargs,
+    jobs,
+    pbar,
+    collect,
+    waves,
+    max_failures,
+    on_done,
+):
+    stacks = list(stacks)
+    total = len(stacks)
+    max_failures = _get_count(max_failures, total)
+    n_ko = 0
+    start = 0
+
+    pbar.total = total
+    pbar.refresh()
+
+    targets = [min(total, max(1, _get_count(w, total))) for w in waves] + [total]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for n, target in enumerate(targets):
+            if target <= start:
+                continue
+            wave = stacks[start:target]
+            start = target
+            logger.info(f"Wave {n + 1}: {len(wave)} stacks [{start}/{total}]")
+
+            future_to_stack = {
+                executor.submit(_run_job, func, s, v, command, region, kwargs): s
+                for s, v in wave
+            }
+            for future in concurrent.futures.as_completed(future_to_stack):
+                name = future_to_stack[future]
+                if future.cancelled():
+                    collect(name, _not_started)
+                    continue
+                failed = collect(name, future.result)
+                if not on_done(name, _get_future_result(future, failed), failed):
+                    n_ko += 1
+                if n_ko > max_failures:
+                    # cancel queued stacks of the current wave
+                    for f in future_to_stack:
+                        f.cancel()
+
+            if n_ko > max_failures:
+                logger.error(f"Rollout halted, {n_ko} stacks failed")
+                for s, v in stacks[start:]:
+                    collect(s, _not_started)
+                break
+
+
+def _skipped(producer):
+    raise IboxError(f"Skipped, depends on {producer} that did not complete")
+
+
+# dependency-aware execution, deps is {stack: set(stacks it depends on)},
+# a stack is submitted as soon as all of them are done and on_done
+# (called with name, result, failed) returned True for each of them,
+# otherwise it and its dependents are skipped
+def _dag_exec(
+    func, stacks, command, region, kwargs, jobs, pbar, collect, deps, on_done
+):
+    stacks = dict(stacks)
+    waiting = {n: set(deps.get(n, [])) & set(stacks) for n in stacks}
+    dependents = {}
+    for n, producers in waiting.items():
+        for p in producers:
+            dependents.setdefault(p, []).append(n)
+
+    pbar.total = len(stacks)
+    pbar.refresh()
+
+    def skip_dependents(name):
+        for d in dependents.get(name, []):
+            if d in waiting:
+                del waiting[d]
+                collect(d, partial(_skipped, name))
+                skip_dependents(d)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        future_to_stack = {}
+        pending = set()
+        while True:
+            for n in [n for n, p in waiting.items() if not p]:
+                del waiting[n]
+                ex_sub = executor.submit(
+                    _run_job, func, n, stacks[n], command, region, kwargs
+                )
+                future_to_stack[ex_sub] = n
+                pending.add(ex_sub)
+
+            if not pending:
+                break
+
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                name = future_to_stack[future]
+                failed = collect(name, future.result)
+                if on_done(name, _get_future_result(future, failed), failed):
+                    for d in dependents.get(name, []):
+                        if d in waiting:
+                            waiting[d].discard(name)
+                else:
+                    skip_dependents(name)
+
+
+# stacks can be a dict or an iterator of (name, data) tuples (streaming
+# discovery), in the latter case jobs are submitted as soon as stacks arrive
+# deps and on_done enable dependency-aware execution (see _dag_exec),
+# waves, max_failures and on_done wave execution (see _wave_exec)
+def concurrent_exec(
+    command,
+    stacks,
+    smodule,
+    region=None,
+    deps=None,
+    waves=None,
+    max_failures=0,
+    on_done=None,
+    **kwargs,
+):
+    from . import tqdm
+
+    n_failed = 0
+    n_done = 0
+    do_exit = False
+    data = {}
+    func = getattr(smodule, "exec_command")
+
+    if isinstance(stacks, dict):
+        total = len(stacks)
+        jobs = min(cfg.jobs, total) if cfg.jobs else total
+        stacks = iter(stacks.items())
+    else:
+        total = None
+        jobs = cfg.jobs if cfg.jobs else cfg.MAX_STREAM_JOBS
+    if jobs == 0:
+        return
+
+    cfg.parallel = False if not cfg.parallel and jobs == 1 else True
+    # the async engine is used only for top level (not nested) jobs
+    # of modules with an async command
+    async_func = getattr(smodule, "exec_command_async", None)
+    use_async = (
+        cfg.engine == "async"
+        and async_func
+        and cfg.parallel
+        and get_current_job() is None
+    )
+    use_pbar = True if total is None or total > 1 else False
+
+    with tqdm(
+        total=total,
+        desc="Processing Stacks",
+        disable=False if use_pbar else True,
+    ) as pbar:
+
+        def collect(stack, get_result):
+            nonlocal n_failed, n_done
+            n_done += 1
+            pbar.update(1)
+            if _set_result(data, stack, get_result):
                 n_failed += 1
                 if use_pbar:
                     pbar.set_postfix(failed=n_failed)
-            except Exception as e:
-                print(f"{stack} generated an exception: {e}")
-                print_exc()
-                raise IboxError(e)
+                return True
+
+        # nested call (ex. stacks of a region), give back the caller slots
+        # while waiting, so that jobs bound the total running ones
+        held = getattr(_local, "semaphores", [])
+        for s in reversed(held):
+            s.release()
+
+        try:
+            if waves:
+                _wave_exec(
+                    func,
+                    stacks,
+                    command,
+                    region,
+                    kwargs,
+                    jobs,
+                    pbar,
+                    collect,
+                    waves,
+                    max_failures,
+                    on_done,
+                )
+            elif deps is not None:
+                _dag_exec(
+                    func,
+                    stacks,
+                    command,
+                    region,
+                    kwargs,
+                    jobs,
+                    pbar,
+                    collect,
+                    deps,
+                    on_done,
+                )
+            elif use_async:
+                import asyncio
 
-    if n_failed == len(stacks):
+                asyncio.run(
+                    _async_exec(
+                        async_func,
+                        stacks,
+                        command,
+                        region,
+                        kwargs,
+                        jobs,
+                        pbar,
+                        collect,
+                    )
+                )
+            else:
+                do_exit = _thread_exec(
+                    func, stacks, command, region, kwargs, jobs, pbar, collect
+                )
+        finally:
+            for s in held:
+                s.acquire()
+
+    if n_done and n_failed == n_done:
         if n_failed > 1:
             logger.error("All Stacks Failed!")
         raise IboxError(pformat(data))
@@ -88,30 +508,6 @@ def concurrent_exec(command, stacks, smodule, region=None, **kwargs):
         return data
 
 
-def get_exports(obj=None):
-    logger.info("Getting CloudFormation Exports")
-    exports = {}
-
-    if not obj:
-        boto3 = myboto3()
-        client = boto3.client("cloudformation")
-    else:
-        boto3 = getattr(obj, "boto3")
-        client = boto3.client("cloudformation")
-
-    paginator = client.get_paginator("list_exports")
-    response_iterator = paginator.paginate()
-    for e in response_iterator:
-        for export in e["Exports"]:
-            name = export["Name"]
-            value = export["Value"]
-            exports[name] = value
-        # if all(key in exports for key in ['BucketAppRepository']):
-        #    return exports
-
-    return exports
-
-
 def stack_resource_to_dict(stack):
     out = {}
     for n in dir(stack):
@@ -125,14 +521,33 @@ def stack_resource_to_dict(stack):
     return out
 
 
-def smodule_to_class(smodule):
-    class obj(object):
-        pass
+# Copy-on-write view of a config module: reads fall through to the module,
+# writes stay local, so per stack/region settings do not leak to others.
+# Thread-safety: the shared cfg module is written by parser and commands
+# before jobs start; jobs must write only to their overlay. Values that
+# are still mutated during a run:
+# - cfg.parallel: written only by concurrent_exec, in the calling thread,
+#   before submitting jobs (a nested call can only confirm it)
+# - cfg.fields / OUT_WIDTH: commands may set them on cfg before jobs
+#   start, stacks set them on their overlay (istack.cfg)
+class cfg_overlay(object):
+    __slots__ = ("_module", "_data")
+
+    def __init__(self, module):
+        object.__setattr__(self, "_module", module)
+        object.__setattr__(self, "_data", {})
+
+    def __getattr__(self, name):
+        try:
+            return self._data[name]
+        except KeyError:
+            return getattr(self._module, name)
 
-    cls = obj()
-    for n in dir(smodule):
-        if not n.startswith("_"):
-            value = getattr(smodule, n)
-            setattr(cls, n, value)
+    def __setattr__(self, name, value):
+        self._data[name] = value
 
-    return cls
+    def __delattr__(self, name):
+        try:
+            del self._data[name]
+        except KeyError:
+            raise AttributeError(name)
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import threading
+
+from . import logger, cfg, tools
+
+# Phase spans, nested per thread, written at exit as Chrome trace
+# (chrome://tracing, Perfetto) or OTLP json. Each stack (or region) job
+# is a row of the trace, spans outside jobs are on their thread row.
+
+_spans = []
+_lock = threading.Lock()
+_local = threading.local()
+_trace_id = os.urandom(16).hex()
+_root = None
+
+
+class span(object):
+    __slots__ = ("name", "attributes", "span_id", "parent_id", "row", "start", "end")
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        global _root
+
+        if not cfg.trace:
+            return self
+
+        try:
+            stack = _local.spans
+        except AttributeError:
+            stack = _local.spans = []
+
+        self.span_id = os.urandom(8).hex()
+        if stack:
+            self.parent_id = stack[-1].span_id
+        else:
+            self.parent_id = _root.span_id if _root else None
+        self.row = tools.get_current_job() or threading.current_thread().name
+        if _root is None and threading.current_thread() is threading.main_thread():
+            _root = self
+        stack.append(self)
+        self.start = time.time_ns()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        global _root
+
+        if not cfg.trace:
+            return
+
+        self.end = time.time_ns()
+        _local.spans.pop()
+        if exc_type:
+            self.attributes["error"] = repr(exc_value)
+        if _root is self:
+            _root = None
+        with _lock:
+            _spans.append(self)
+
+
+def _get_chrome_trace(spans):
+    pid = os.getpid()
+    start = min(s.start for s in spans)
+    rows = {}
+    events = []
+
+    for s in sorted(spans, key=lambda x: (x.start, -x.end)):
+        if s.row not in rows:
+            rows[s.row] = len(rows) + 1
+            events.append(
+                {
+                    "ph": "M",
+                    "name": "thread_name",
+                    "pid": pid,
+                    "tid": rows[s.row],
+                    "args": {"name": s.row},
+                }
+            )
+        events.append(
+            {
+                "ph": "X",
+                "name": s.name,
+                "cat": s.name.split(".")[0],
+                "pid": pid,
+                "tid": rows[s.row],
+                "ts": (s.start - start) / 1000,
+                "dur": (s.end - s.start) / 1000,
+                "args": {k: str(v) for k, v in s.attributes.items()},
+            }
+        )
+
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def _get_otlp_trace(spans):
+    otlp_spans = []
+    for s in spans:
+        attributes = dict(s.attributes, job=s.row)
+        otlp_span = {
+            "traceId": _trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,
+            "startTimeUnixNano": str(s.start),
+            "endTimeUnixNano": str(s.end),
+            "attributes": [
+                {"key": k, "value": {"stringValue": str(v)}}
+                for k, v in attributes.items()
+            ],
+            "status": {"code": 2 if "error" in attributes else 1},
+        }
+        if s.parent_id:
+            otlp_span["parentSpanId"] = s.parent_id
+        otlp_spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {
+                            "key": "service.name",
+                            "value": {"stringValue": "iboxstacksops"},
+                        }
+                    ]
+                },
+                "scopeSpans": [
+                    {"scope": {"name": "iboxstacksops"}, "spans": otlp_spans}
+                ],
+            }
+        ]
+    }
+
+
+def save():
+    if not cfg.trace or not _spans:
+        return
+
+    with _lock:
+        spans = list(_spans)
+    if cfg.trace_format == "otlp":
+        data = _get_otlp_trace(spans)
+    else:
+        data = _get_chrome_trace(spans)
+
+    try:
+        with open(cfg.trace, "w") as f:
+            json.dump(data, f)
+    except Exception as e:
+        logger.warning(f"Unable to write trace to {cfg.trace}: {e}")
+        return
+
+    logger.info(f"Traced {len(spans)} spans to {cfg.trace}")
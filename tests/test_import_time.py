@@ -0,0 +1,91 @@
+import os
+import re
+import sys
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# max import time (ms) of iboxstacksops modules, measured with
+# python -X importtime, for commands that should start fast
+IMPORT_TIME_BUDGET_MS = 100
+
+# modules that must not be loaded just to parse args and load commands
+HEAVY_MODULES = [
+    "boto3",
+    "botocore",
+    "yaml",
+    "prettytable",
+    "tqdm",
+    "iboxstacksops.i_stack",
+    "iboxstacksops.dashboard",
+]
+
+IMPORTTIME_RE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| (\S.*)$")
+
+PARSE_CODE = (
+    "import sys\n"
+    "from iboxstacksops.parser import set_cfg\n"
+    "set_cfg(sys.argv[1:])\n"
+    f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+)
+
+
+def _run(args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    # first run compile bytecode, do not measure it
+    for _ in range(2):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime"] + args,
+            cwd=ROOT,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+
+    return result
+
+
+# cumulative import time (ms) of top level iboxstacksops modules
+def _get_import_time(stderr):
+    total = 0
+    for line in stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match and match.group(2).startswith("iboxstacksops"):
+            total += int(match.group(1))
+
+    return total / 1000
+
+
+def test_version_import_time():
+    result = _run(["-m", "iboxstacksops", "version"])
+
+    assert result.returncode == 0, result.stderr
+    assert _get_import_time(result.stderr) < IMPORT_TIME_BUDGET_MS
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["log", "-s", "foo"],
+        ["show", "-r", "foo"],
+        ["update", "-s", "foo"],
+    ],
+)
+def test_parse_import_time(argv):
+    result = _run(["-c", PARSE_CODE] + argv)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
+    assert _get_import_time(result.stderr) < IMPORT_TIME_BUDGET_MS
+
+
+def test_simulator_not_imported():
+    code = (
+        "import sys, iboxstacksops.aws\nprint('iboxstacksops.simulator' in sys.modules)"
+    )
+    result = _run(["-c", code])
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "False"